@@ -1,23 +1,25 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import json
-import duckdb
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import os
 import logging
 import subprocess
 import sys
+import threading
 from pathlib import Path
 from dotenv import load_dotenv
-from datetime import datetime
 
 # Componentes
 from components import (
     load_custom_css,
     metric_card,
+    render_metric_row,
     info_box,
     progress_bar
 )
+from duckdb_pipeline import DuckDBPipeline, PAGE_SIZE
 
 # Configuração
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
@@ -28,6 +30,7 @@ PROJECT_ROOT = Path(__file__).parent.parent
 DATA_DIR = PROJECT_ROOT / "data"
 DB_FILENAME = "database.duckdb"
 full_duckdb_path = (DATA_DIR / DB_FILENAME).resolve()
+SYNC_TIMEOUT = 300
 
 # Configurar variáveis para o script de bootstrap
 os.environ["DUCKDB_PATH"] = DB_FILENAME
@@ -58,339 +61,90 @@ if not full_duckdb_path.parent.exists():
         st.error(f"Erro ao criar diretório de dados: {e}")
 
 
-# Pipeline
-class DuckDBPipeline:
-    def __init__(self, db_path: str):
-        try:
-            self.conn = duckdb.connect(db_path)
-            self.create_metadata_tables()
-            self.sync_metadata_with_existing_tables()
-        except Exception as e:
-            st.error(f"Erro ao conectar ao banco de dados: {e}")
-
-    def create_metadata_tables(self):
-        try:
-            self.conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS table_metadata (
-                    table_name VARCHAR PRIMARY KEY,
-                    schema_json JSON
-                );
-                """
-            )
-            self.conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS fk_metadata (
-                    table_name VARCHAR,
-                    column_name VARCHAR,
-                    ref_table VARCHAR,
-                    ref_column VARCHAR,
-                    PRIMARY KEY (table_name, column_name)
-                );
-                """
-            )
-        except Exception as e:
-            logging.error(f"Erro ao criar tabelas de metadados: {e}")
-
-    def sync_metadata_with_existing_tables(self):
-        try:
-            tables = self.conn.execute("SHOW TABLES").fetchall()
-            for (table,) in tables:
-                if table not in ("table_metadata", "fk_metadata"):
-                    exists = self.conn.execute(
-                        "SELECT 1 FROM table_metadata WHERE table_name = ?",
-                        (table,)
-                    ).fetchone()
-                    if not exists:
-                        self.register_table_metadata(table)
-        except Exception as e:
-            logging.error(f"Erro ao sincronizar metadados: {e}")
+# Instância Pipeline
+@st.cache_resource
+def get_pipeline():
+    return DuckDBPipeline(str(full_duckdb_path))
 
-    def register_table_metadata(self, table_name: str):
-        try:
-            columns_info = self.conn.execute(
-                f"PRAGMA table_info('{table_name}')"
-            ).fetchall()
-            try:
-                fk_info = self.conn.execute(
-                    f"PRAGMA foreign_key_list('{table_name}')"
-                ).fetchall()
-            except Exception:
-                fk_info = []
-
-            metadata = {}
-            pk_found = False
-
-            for col in columns_info:
-                col_name = col[1]
-                data_type = col[2]
-                is_pk = bool(col[5])
-                if is_pk:
-                    pk_found = True
-                metadata[col_name] = {
-                    "data_type": data_type,
-                    "primary_key": is_pk,
-                    "foreign_key": None
-                }
-            if not pk_found:
-                for col in metadata:
-                    metadata[col]["primary_key"] = False
-
-            if fk_info:
-                for fk in fk_info:
-                    fk_column = fk[3]
-                    ref_table = fk[2]
-                    ref_column = fk[4]
-                    if fk_column in metadata:
-                        metadata[fk_column]["foreign_key"] = {"table": ref_table, "column": ref_column}
-                        self.conn.execute(
-                            """
-                            INSERT INTO fk_metadata (table_name, column_name, ref_table, ref_column)
-                            VALUES (?, ?, ?, ?)
-                            ON CONFLICT DO NOTHING;
-                            """,
-                            (table_name, fk_column, ref_table, ref_column)
-                        )
-            self.conn.execute(
-                """
-                INSERT INTO table_metadata (table_name, schema_json)
-                VALUES (?, ?)
-                ON CONFLICT (table_name) DO UPDATE SET schema_json = excluded.schema_json;
-                """,
-                (table_name, json.dumps(metadata))
-            )
-        except Exception as e:
-            logging.error(f"Erro ao registrar metadados para {table_name}: {e}")
+pipeline = get_pipeline()
 
-    def create_table_dynamic(self, table_name: str, fields: list):
-        try:
-            exists = self.conn.execute(
-                "SELECT 1 FROM table_metadata WHERE table_name = ?",
-                (table_name,)
-            ).fetchone()
-            if exists:
-                raise ValueError(f"A tabela '{table_name}' já existe na pipeline.")
-
-            column_defs = []
-            metadata = {}
-            pk_columns = []
-
-            for field in fields:
-                col_name = field.get("name")
-                if not col_name:
-                    raise ValueError("Cada campo deve ter um 'name' definido.")
-                data_type = field.get("data_type", "VARCHAR").strip() or "VARCHAR"
-                col_def = f"{col_name} {data_type}"
-                is_pk = field.get("primary_key", False)
-                if is_pk:
-                    pk_columns.append(col_name)
-                metadata[col_name] = {
-                    "data_type": data_type,
-                    "primary_key": is_pk,
-                    "foreign_key": None
-                }
-                fk = field.get("foreign_key")
-                if fk:
-                    fk_table = fk.get("table")
-                    fk_column = fk.get("column")
-                    if fk_table and fk_column:
-                        col_def += f" REFERENCES {fk_table}({fk_column})"
-                        metadata[col_name]["foreign_key"] = {"table": fk_table, "column": fk_column}
-                    else:
-                        raise ValueError(f"Chave estrangeira inválida para a coluna '{col_name}'")
-                column_defs.append(col_def)
+# Auxiliares
+class _SyncLogHandler(logging.Handler):
+    """Coleta os logs do loader enquanto a sincronização roda no processo do app."""
 
-            if pk_columns:
-                if len(pk_columns) > 1:
-                    column_defs.append(f"PRIMARY KEY ({', '.join(pk_columns)})")
-            else:
-                for col in metadata:
-                    metadata[col]["primary_key"] = False
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+        self.lines = []
+        self.failed = False
 
-            sql = f"CREATE TABLE {table_name} ({', '.join(column_defs)});"
-            self.conn.execute(sql)
-            
-            self.conn.execute(
-                """
-                INSERT INTO table_metadata (table_name, schema_json)
-                VALUES (?, ?);
-                """,
-                (table_name, json.dumps(metadata))
-            )
-            for field in fields:
-                fk = field.get("foreign_key")
-                if fk:
-                    fk_table = fk.get("table")
-                    fk_column = fk.get("column")
-                    self.conn.execute(
-                        """
-                        INSERT INTO fk_metadata (table_name, column_name, ref_table, ref_column)
-                        VALUES (?, ?, ?, ?)
-                        ON CONFLICT DO NOTHING;
-                        """,
-                        (table_name, field.get("name"), fk_table, fk_column)
-                    )
-            return True
-        except Exception as e:
-            raise e
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        if record.levelno >= logging.ERROR:
+            self.failed = True
 
-    def add_column(self, table_name: str, field: dict):
-        try:
-            col_name = field.get("name")
-            if not col_name:
-                raise ValueError("Nome da coluna é obrigatório.")
-            data_type = field.get("data_type", "VARCHAR").strip() or "VARCHAR"
-            alter_sql = f"ALTER TABLE {table_name} ADD COLUMN {col_name} {data_type};"
-            self.conn.execute(alter_sql)
-            
-            metadata = self.get_table_metadata(table_name)
-            metadata[col_name] = {
-                "data_type": data_type,
-                "primary_key": field.get("primary_key", False),
-                "foreign_key": None
-            }
-            fk = field.get("foreign_key")
-            if fk:
-                fk_table = fk.get("table")
-                fk_column = fk.get("column")
-                if fk_table and fk_column:
-                    metadata[col_name]["foreign_key"] = {"table": fk_table, "column": fk_column}
-                    self.conn.execute(
-                        """
-                        INSERT INTO fk_metadata (table_name, column_name, ref_table, ref_column)
-                        VALUES (?, ?, ?, ?)
-                        ON CONFLICT DO NOTHING;
-                        """,
-                        (table_name, col_name, fk_table, fk_column)
-                    )
-            self.conn.execute(
-                "UPDATE table_metadata SET schema_json = ? WHERE table_name = ?;",
-                (json.dumps(metadata), table_name)
-            )
-            return True
-        except Exception as e:
-            raise e
 
-    def get_table_metadata(self, table_name: str):
-        try:
-            row = self.conn.execute(
-                "SELECT schema_json FROM table_metadata WHERE table_name = ?",
-                (table_name,)
-            ).fetchone()
-            return json.loads(row[0]) if row else {}
-        except Exception as e:
-            st.error(f"Erro ao obter metadados: {str(e)}")
-            return {}
+def run_supabase_sync():
+    # Processo separado só sob demanda: o padrão reaproveita o banco já aberto
+    if os.getenv("SYNC_SUBPROCESS", "false").lower() == "true":
+        run_supabase_sync_subprocess()
+        return
 
-    def insert_data(self, table_name: str, data: dict):
-        try:
-            metadata = self.get_table_metadata(table_name)
-            
-            # Validação de FK
-            for col, info in metadata.items():
-                fk = info.get("foreign_key")
-                if fk and col in data and data[col] != "":
-                    ref_table = fk.get("table")
-                    ref_column = fk.get("column")
-                    value = data[col]
-                    exists = self.conn.execute(
-                        f"SELECT 1 FROM {ref_table} WHERE {ref_column} = ?",
-                        (value,)
-                    ).fetchone()
-                    if not exists:
-                        st.error(f"Valor '{value}' para a coluna '{col}' não existe na tabela referenciada '{ref_table}'.")
-                        return False
-
-            # Validação de PK
-            primary_keys = [col for col, info in metadata.items() if info.get("primary_key")]
-            if primary_keys:
-                missing = [pk for pk in primary_keys if not data.get(pk)]
-                if missing:
-                    st.error(f"Valores faltando para chave(s) primária(s): {', '.join(missing)}")
-                    return False
-                conditions = " AND ".join([f"{pk} = ?" for pk in primary_keys])
-                values = tuple(data[pk] for pk in primary_keys)
-                exists = self.conn.execute(
-                    f"SELECT 1 FROM {table_name} WHERE {conditions}",
-                    values
-                ).fetchone()
-                if exists:
-                    st.error(f"Registro com chave primária já existe.")
-                    return False
-
-            columns = ", ".join(data.keys())
-            placeholders = ", ".join(["?"] * len(data))
-            
-            self.conn.execute(
-                f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})",
-                list(data.values())
-            )
-            return True
-        except Exception as e:
-            st.error(f"Erro ao inserir: {str(e)}")
-            return False
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.append(str(PROJECT_ROOT))
+    try:
+        from scripts import incremental_loader
+    except Exception as e:
+        st.error(f"Erro ao carregar o loader: {e}")
+        return
 
-    def update_data(self, table_name: str, set_data: dict, where_clause: str, where_params: tuple):
-        try:
-            set_str = ", ".join([f"{col} = ?" for col in set_data.keys()])
-            sql = f"UPDATE {table_name} SET {set_str} WHERE {where_clause};"
-            values = tuple(set_data.values()) + where_params
-            self.conn.execute(sql, values)
-            return True
-        except Exception as e:
-            st.error(f"Erro na atualização: {str(e)}")
-            return False
+    # No processo do app só o Supabase: o S3 instala o httpfs e grava credenciais
+    # na conexão DuckDB, que aqui seria a mesma da interface
+    if incremental_loader.DESTINATION_TYPE != "SUPABASE":
+        run_supabase_sync_subprocess()
+        return
 
-    def delete_data(self, table_name: str, where_clause: str, where_params: tuple):
-        try:
-            sql = f"DELETE FROM {table_name} WHERE {where_clause};"
-            self.conn.execute(sql, where_params)
-            return True
-        except Exception as e:
-            st.error(f"Erro na deleção: {str(e)}")
-            return False
+    handler = _SyncLogHandler()
+    loader_logger = incremental_loader.logger
+    loader_logger.setLevel(logging.INFO)
+    loader_logger.addHandler(handler)
 
-    def delete_table(self, table_name: str):
-        try:
-            self.conn.execute(f"DROP TABLE IF EXISTS {table_name};")
-            self.conn.execute("DELETE FROM table_metadata WHERE table_name = ?;", (table_name,))
-            self.conn.execute("DELETE FROM fk_metadata WHERE table_name = ?;", (table_name,))
-            return True
-        except Exception as e:
-            st.error(f"Erro ao dropar tabela: {str(e)}")
-            return False
+    errors = []
 
-    def list_tables(self):
+    def sync():
         try:
-            rows = self.conn.execute("SELECT table_name FROM table_metadata;").fetchall()
-            return [r[0] for r in rows]
+            # Cursor emprestado do pool: a leitura não disputa a conexão usada pelas escritas
+            with pipeline.read_cursor() as cursor:
+                incremental_loader.run(cursor, timeout=SYNC_TIMEOUT)
         except Exception as e:
-            st.error(f"Erro ao listar tabelas: {str(e)}")
-            return []
+            errors.append(e)
+        finally:
+            loader_logger.removeHandler(handler)
 
-    def get_table_data(self, table_name: str):
-        try:
-            return self.conn.execute(f"SELECT * FROM {table_name};").fetchdf()
-        except Exception as e:
-            st.error(f"Erro ao carregar dados: {str(e)}")
-            return pd.DataFrame()
+    worker = threading.Thread(target=sync, name="supabase-sync", daemon=True)
+    with st.spinner("Sincronizando com Supabase..."):
+        worker.start()
+        worker.join(SYNC_TIMEOUT)
 
-    def get_table_stats(self, table_name: str):
-        try:
-            count = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-            return {"count": count}
-        except Exception:
-            return {"count": 0}
+    if worker.is_alive():
+        # O loader não inicia novas tabelas depois do prazo e encerra sozinho
+        st.error("Timeout: O processo demorou mais que o esperado.")
+        return
+    if errors:
+        st.error(f"Erro interno: {str(errors[0])}")
+        return
 
-# Instância Pipeline
-@st.cache_resource
-def get_pipeline():
-    return DuckDBPipeline(str(full_duckdb_path))
+    log_text = "\n".join(handler.lines)
+    if handler.failed:
+        st.error("Erro na sincronização!")
+        st.code(log_text, language="log")
+    else:
+        st.success("Sincronização concluída com sucesso!")
+        with st.expander("Ver log detalhado"):
+            st.code(log_text, language="log")
 
-pipeline = get_pipeline()
 
-# Auxiliares
-def run_supabase_sync():
+def run_supabase_sync_subprocess():
     script_path = Path(__file__).parent.parent / "scripts" / "incremental_loader.py"
     try:
         with st.spinner("Sincronizando com Supabase..."):
@@ -398,7 +152,7 @@ def run_supabase_sync():
                 [sys.executable, str(script_path)],
                 capture_output=True,
                 text=True,
-                timeout=300
+                timeout=SYNC_TIMEOUT
             )
             if result.returncode == 0:
                 st.success("Sincronização concluída com sucesso!")
@@ -420,24 +174,22 @@ def page_dashboard():
     tables = pipeline.list_tables()
 
     # Coletar estatísticas
-    total_rows = sum([pipeline.get_table_stats(t)["count"] for t in tables])
+    counts = pipeline.get_all_table_stats(tables)
+    total_rows = sum(counts.values())
     try:
         db_size = full_duckdb_path.stat().st_size / (1024 * 1024)
     except:
         db_size = 0
-    total_cols = sum([len(pipeline.get_table_metadata(t)) for t in tables])
+    column_counts = pipeline.get_column_counts()
+    total_cols = sum(column_counts.get(t, 0) for t in tables)
 
     st.markdown("### Métricas Principais")
-    col1, col2, col3, col4 = st.columns(4)
-
-    with col1:
-        metric_card("Tabelas", f"{len(tables)}", icon="🗂️")
-    with col2:
-        metric_card("Registros", f"{total_rows:,}", icon="📝", trend="+12%", trend_color="green")
-    with col3:
-        metric_card("Armazenamento", f"{db_size:.1f} MB", icon="💾")
-    with col4:
-        metric_card("Colunas", f"{total_cols}", icon="📋")
+    render_metric_row([
+        {"label": "Tabelas", "value": f"{len(tables)}", "icon": "🗂️"},
+        {"label": "Registros", "value": f"{total_rows:,}", "icon": "📝", "trend": "+12%", "trend_color": "green"},
+        {"label": "Armazenamento", "value": f"{db_size:.1f} MB", "icon": "💾"},
+        {"label": "Colunas", "value": f"{total_cols}", "icon": "📋"},
+    ])
 
     st.markdown("---")
 
@@ -446,12 +198,7 @@ def page_dashboard():
     with col_charts_1:
         if tables:
             st.markdown("#### Distribuição de Dados")
-            table_data = []
-            for table in tables:
-                stats = pipeline.get_table_stats(table)
-                table_data.append({"Tabela": table, "Registros": stats["count"]})
-
-            df_stats = pd.DataFrame(table_data)
+            df_stats = pd.DataFrame({"Tabela": list(counts), "Registros": list(counts.values())})
             
             fig = px.bar(
                 df_stats, 
@@ -495,24 +242,62 @@ def page_view_data():
         table_name = st.selectbox("Selecione a Tabela", tables)
 
     if table_name:
-        df = pipeline.get_table_data(table_name)
+        offset_key = f"offset_{table_name}"
+        offset = st.session_state.get(offset_key, 0)
+        data = pipeline.get_table_data(table_name, offset, PAGE_SIZE)
+        if not data.num_rows and offset:
+            # Tabela encolheu abaixo da página guardada: volta ao início em vez de prender na página vazia
+            offset = st.session_state[offset_key] = 0
+            data = pipeline.get_table_data(table_name, offset, PAGE_SIZE)
         metadata = pipeline.get_table_metadata(table_name)
         
         # Tabs
         tab1, tab2 = st.tabs(["📄 Dados", "🔧 Estrutura"])
         
         with tab1:
-            if not df.empty:
-                st.dataframe(df, use_container_width=True, height=400)
-                
-                # Download
-                csv = df.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 Download CSV",
-                    data=csv,
-                    file_name=f"{table_name}.csv",
-                    mime="text/csv"
-                )
+            if data.num_rows:
+                st.dataframe(data, use_container_width=True, height=400)
+
+                # Paginação
+                total = pipeline.get_table_size_estimate(table_name)
+                col_prev, col_info, col_next = st.columns([1, 2, 1])
+                with col_prev:
+                    if st.button("◀ Anterior", disabled=offset == 0):
+                        st.session_state[offset_key] = max(0, offset - PAGE_SIZE)
+                        st.rerun()
+                with col_info:
+                    st.caption(f"Linhas {offset + 1}–{offset + data.num_rows} de ~{total:,}")
+                with col_next:
+                    if st.button("Próxima ▶", disabled=data.num_rows < PAGE_SIZE):
+                        st.session_state[offset_key] = offset + PAGE_SIZE
+                        st.rerun()
+
+                col_page, col_full = st.columns(2)
+                with col_page:
+                    # Download da página exibida
+                    buffer = pa.BufferOutputStream()
+                    pacsv.write_csv(data, buffer)
+                    csv = buffer.getvalue().to_pybytes()
+                    st.download_button(
+                        label=f"📥 Download CSV (página atual: linhas {offset + 1}–{offset + data.num_rows})",
+                        data=csv,
+                        file_name=f"{table_name}_pagina_{offset // PAGE_SIZE + 1}.csv",
+                        mime="text/csv"
+                    )
+                with col_full:
+                    # Tabela completa só sob demanda: o COPY do DuckDB não roda a cada rerun da página
+                    export_key = f"export_{table_name}"
+                    if st.button("📦 Preparar CSV da tabela completa"):
+                        st.session_state[export_key] = pipeline.export_table_csv(table_name)
+                    full_csv = st.session_state.get(export_key)
+                    if full_csv is not None:
+                        st.download_button(
+                            label="📥 Download CSV (tabela completa)",
+                            data=full_csv,
+                            file_name=f"{table_name}.csv",
+                            mime="text/csv",
+                            key=f"download_full_{table_name}"
+                        )
             else:
                 info_box("Tabela Vazia", "Nenhum dado encontrado nesta tabela.", type="info")
 
@@ -535,7 +320,9 @@ def page_crud():
         return
 
     # Usando tabs para separar operações CRUD de forma limpa
-    tab_insert, tab_update, tab_delete = st.tabs(["➕ Inserir", "🔄 Atualizar", "🗑️ Remover"])
+    tab_insert, tab_import, tab_update, tab_delete = st.tabs(
+        ["➕ Inserir", "📤 Importar CSV", "🔄 Atualizar", "🗑️ Remover"]
+    )
 
     with tab_insert:
         table_name = st.selectbox("Tabela para Inserção", tables, key="ins_table")
@@ -555,6 +342,31 @@ def page_crud():
                     st.success("Registro inserido!")
                     st.rerun()
 
+    with tab_import:
+        table_name_imp = st.selectbox("Tabela para Importação", tables, key="imp_table")
+        metadata = pipeline.get_table_metadata(table_name_imp)
+
+        with st.form("import_form", clear_on_submit=True):
+            st.caption(f"Cabeçalho esperado: {', '.join(metadata.keys())}")
+            uploaded = st.file_uploader("Arquivo CSV", type="csv")
+
+            if st.form_submit_button("Importar Registros", type="primary") and uploaded is not None:
+                try:
+                    # Tudo lido como texto e entregue como pa.Table: a conversão fica no SQL do bulk_insert
+                    table = pacsv.read_csv(
+                        uploaded,
+                        convert_options=pacsv.ConvertOptions(
+                            column_types={c: pa.string() for c in metadata},
+                            strings_can_be_null=True,
+                        ),
+                    )
+                except Exception as e:
+                    st.error(f"Erro ao ler o CSV: {e}")
+                else:
+                    if pipeline.bulk_insert(table_name_imp, table):
+                        st.success(f"{table.num_rows} registro(s) importado(s)!")
+                        st.rerun()
+
     with tab_update:
         table_name_up = st.selectbox("Tabela para Atualização", tables, key="up_table")
         metadata = pipeline.get_table_metadata(table_name_up)
@@ -734,19 +546,29 @@ with st.sidebar:
         st.markdown("**Diagnóstico Interno:**")
         try:
             # Tabelas Físicas
-            raw_tables = pipeline.conn.execute("SHOW TABLES").fetchall()
+            raw_tables = pipeline.list_physical_tables()
             st.write(f"Tabelas Físicas ({len(raw_tables)}):")
-            st.code([t[0] for t in raw_tables])
+            st.code(raw_tables)
             
             # Metadados
-            meta_tables = pipeline.conn.execute("SELECT table_name FROM table_metadata").fetchall()
+            meta_tables = pipeline.list_tables()
             st.write(f"Metadados ({len(meta_tables)}):")
-            st.code([t[0] for t in meta_tables])
+            st.code(meta_tables)
             
             if st.button("Forçar Re-Sync"):
                 pipeline.sync_metadata_with_existing_tables()
                 st.success("Sincronização forçada!")
                 st.rerun()
+
+            if st.button("Checkpoint + VACUUM"):
+                if pipeline.checkpoint(vacuum=True):
+                    # O DuckDB reaproveita os blocos livres, mas não devolve espaço ao sistema
+                    st.success(
+                        "Checkpoint executado: WAL gravado no arquivo e espaço livre recuperado internamente "
+                        "para novas escritas. O tamanho do arquivo não diminui."
+                    )
+                else:
+                    st.error("Não foi possível executar o checkpoint agora; tente novamente.")
         except Exception as e:
             st.error(f"Erro ao ler DB: {e}")
     
@@ -0,0 +1,709 @@
+"""
+Camada de acesso ao DuckDB usada pelo app: conexão, pool de cursores de leitura,
+metadados das tabelas e operações de escrita.
+"""
+
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import duckdb
+import pyarrow as pa
+import streamlit as st
+
+# orjson quando disponível: (de)serializa os metadados bem mais rápido que o json
+try:
+    import orjson
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+
+PAGE_SIZE = 1000
+POOL_SIZE = 4
+# Espera máxima por um cursor livre antes de desistir da leitura
+POOL_TIMEOUT = 30
+
+# Limites explícitos: o padrão do DuckDB usa todos os núcleos e 80% da RAM por conexão
+DUCKDB_CONFIG = {
+    "threads": os.getenv("DUCKDB_THREADS", str(min(8, os.cpu_count() or 4))),
+    "memory_limit": os.getenv("DUCKDB_MEMORY_LIMIT", "2GB"),
+}
+# Letra (inclusive acentuada) ou "_" seguida de letras, dígitos ou "_": aceita nomes como "região"
+IDENT_RE = re.compile(r"^[^\W\d]\w*\Z", re.UNICODE)
+
+
+# Pipeline
+def _serialized(method):
+    # O DuckDB serializa escritas de qualquer forma; o lock evita que duas
+    # sessões intercalem statements de uma mesma operação na conexão principal
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._write_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class DuckDBPipeline:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._write_lock = threading.RLock()
+        self._pool = queue.Queue(maxsize=POOL_SIZE)
+        self._ident_cache = {}
+        # Caches em memória já decodificados, válidos enquanto o arquivo do banco não mudar
+        self._meta_cache = {}
+        self._stats_cache = {}
+        self._cache_mtime = None
+        self._tables_cache = None
+        self._column_counts = None
+        self.conn = None
+        try:
+            self.conn = duckdb.connect(db_path, config=DUCKDB_CONFIG)
+            self.conn.execute("PRAGMA enable_object_cache")
+            # WAL pendente de sessões anteriores vai para o arquivo antes de abrir o app
+            self.checkpoint()
+            # Cursores compartilham a instância do banco e atendem leituras em paralelo
+            for _ in range(POOL_SIZE):
+                self._pool.put(self.conn.cursor())
+            self.create_metadata_tables()
+            self.sync_metadata_with_existing_tables()
+        except Exception as e:
+            st.error(f"Erro ao conectar ao banco de dados: {e}")
+
+    @contextmanager
+    def _borrow(self):
+        """Empresta um cursor do pool para uma leitura."""
+        if self.conn is None:
+            raise RuntimeError("Banco de dados indisponível: a conexão não foi aberta.")
+        try:
+            cursor = self._pool.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError(
+                f"Nenhum cursor livre no pool após {POOL_TIMEOUT}s."
+            ) from None
+        try:
+            yield cursor
+        finally:
+            self._pool.put(cursor)
+
+    def _q(self, name: str) -> str:
+        """Valida o identificador uma única vez e devolve a forma entre aspas."""
+        quoted = self._ident_cache.get(name)
+        if quoted is None:
+            if not isinstance(name, str) or not IDENT_RE.match(name):
+                raise ValueError(f"Identificador inválido: '{name}'")
+            quoted = '"' + name.replace('"', '""') + '"'
+            self._ident_cache[name] = quoted
+        return quoted
+
+    def _has_unique_constraint(self, table_name: str) -> bool:
+        """Consulta o catálogo: o ON CONFLICT só vale com PK/UNIQUE real, não com a PK dos metadados."""
+        row = self.conn.execute(
+            """
+            SELECT count(*) > 0 FROM duckdb_constraints()
+            WHERE database_name = current_database() AND schema_name = 'main'
+              AND table_name = ? AND constraint_type IN ('PRIMARY KEY', 'UNIQUE')
+            """,
+            (table_name,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def create_metadata_tables(self):
+        try:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS table_metadata (
+                    table_name VARCHAR PRIMARY KEY,
+                    schema_json JSON
+                );
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fk_metadata (
+                    table_name VARCHAR,
+                    column_name VARCHAR,
+                    ref_table VARCHAR,
+                    ref_column VARCHAR,
+                    PRIMARY KEY (table_name, column_name)
+                );
+                """
+            )
+        except Exception as e:
+            logging.error(f"Erro ao criar tabelas de metadados: {e}")
+
+    @_serialized
+    def sync_metadata_with_existing_tables(self):
+        try:
+            tables = [t[0] for t in self.conn.execute("SHOW TABLES").fetchall()]
+            registered = {r[0] for r in self.conn.execute("SELECT table_name FROM table_metadata").fetchall()}
+            missing = [
+                t for t in tables
+                if t not in ("table_metadata", "fk_metadata") and t not in registered
+            ]
+            if missing:
+                self._write_metadata(*self._collect_metadata(missing))
+        except Exception as e:
+            logging.error(f"Erro ao sincronizar metadados: {e}")
+
+    @_serialized
+    def register_table_metadata(self, table_name: str):
+        try:
+            self._write_metadata(*self._collect_metadata([table_name]))
+        except Exception as e:
+            logging.error(f"Erro ao registrar metadados para {table_name}: {e}")
+
+    def _collect_metadata(self, tables: list):
+        """Lê colunas, PKs e FKs de várias tabelas com duas consultas ao catálogo."""
+        metadata = {t: {} for t in tables}
+        columns = self.conn.execute(
+            """
+            SELECT table_name, column_name, data_type
+            FROM duckdb_columns()
+            WHERE schema_name = 'main' AND list_contains(?, table_name)
+            ORDER BY table_name, column_index;
+            """,
+            (tables,)
+        ).fetchall()
+        for table, col_name, data_type in columns:
+            metadata[table][col_name] = {
+                "data_type": data_type,
+                "primary_key": False,
+                "foreign_key": None
+            }
+
+        constraints = self.conn.execute(
+            """
+            SELECT table_name, constraint_type, constraint_column_names,
+                   referenced_table, referenced_column_names
+            FROM duckdb_constraints()
+            WHERE schema_name = 'main'
+              AND constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')
+              AND list_contains(?, table_name);
+            """,
+            (tables,)
+        ).fetchall()
+        fk_rows = []
+        for table, constraint_type, col_names, ref_table, ref_columns in constraints:
+            for i, col_name in enumerate(col_names):
+                if col_name not in metadata[table]:
+                    continue
+                if constraint_type == "PRIMARY KEY":
+                    metadata[table][col_name]["primary_key"] = True
+                else:
+                    ref_column = ref_columns[i]
+                    metadata[table][col_name]["foreign_key"] = {"table": ref_table, "column": ref_column}
+                    fk_rows.append((table, col_name, ref_table, ref_column))
+        return metadata, fk_rows
+
+    def _write_metadata(self, metadata: dict, fk_rows: list):
+        # Uma transação e um executemany por tabela de metadados: um único commit no WAL
+        self.conn.execute("BEGIN TRANSACTION")
+        try:
+            if fk_rows:
+                self.conn.executemany(
+                    """
+                    INSERT INTO fk_metadata (table_name, column_name, ref_table, ref_column)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT DO NOTHING;
+                    """,
+                    fk_rows
+                )
+            self.conn.executemany(
+                """
+                INSERT INTO table_metadata (table_name, schema_json)
+                VALUES (?, ?)
+                ON CONFLICT (table_name) DO UPDATE SET schema_json = excluded.schema_json;
+                """,
+                [(table_name, _json_dumps(table_meta)) for table_name, table_meta in metadata.items()]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.invalidate_metadata_cache()
+
+    @_serialized
+    def create_table_dynamic(self, table_name: str, fields: list):
+        try:
+            exists = self.conn.execute(
+                "SELECT 1 FROM table_metadata WHERE table_name = ?",
+                (table_name,)
+            ).fetchone()
+            if exists:
+                raise ValueError(f"A tabela '{table_name}' já existe na pipeline.")
+
+            column_defs = []
+            metadata = {}
+            pk_columns = []
+
+            # PK única "id" inteira ganha uma SEQUENCE em vez de exigir o valor no insert
+            id_type = next((f.get("data_type", "") for f in fields if f.get("name") == "id"), "")
+            auto_increment = (
+                [f.get("name") for f in fields if f.get("primary_key")] == ["id"]
+                and id_type.strip().upper() in ("INTEGER", "BIGINT")
+            )
+            sequence_name = f"seq_{table_name}"
+
+            for field in fields:
+                col_name = field.get("name")
+                if not col_name:
+                    raise ValueError("Cada campo deve ter um 'name' definido.")
+                data_type = field.get("data_type", "VARCHAR").strip() or "VARCHAR"
+                col_def = f"{self._q(col_name)} {data_type}"
+                is_pk = field.get("primary_key", False)
+                if is_pk:
+                    pk_columns.append(col_name)
+                metadata[col_name] = {
+                    "data_type": data_type,
+                    "primary_key": is_pk,
+                    "foreign_key": None
+                }
+                if auto_increment and col_name == "id":
+                    col_def += f" DEFAULT nextval('{sequence_name}') PRIMARY KEY"
+                    metadata[col_name]["auto_increment"] = True
+                fk = field.get("foreign_key")
+                if fk:
+                    fk_table = fk.get("table")
+                    fk_column = fk.get("column")
+                    if fk_table and fk_column:
+                        col_def += f" REFERENCES {self._q(fk_table)}({self._q(fk_column)})"
+                        metadata[col_name]["foreign_key"] = {"table": fk_table, "column": fk_column}
+                    else:
+                        raise ValueError(f"Chave estrangeira inválida para a coluna '{col_name}'")
+                column_defs.append(col_def)
+
+            if pk_columns:
+                if not auto_increment:
+                    column_defs.append(f"PRIMARY KEY ({', '.join(self._q(c) for c in pk_columns)})")
+            else:
+                for col in metadata:
+                    metadata[col]["primary_key"] = False
+
+            # SEQUENCE, tabela e metadados numa transação só: DDL que falha não deixa sequência órfã
+            self.conn.execute("BEGIN TRANSACTION")
+            try:
+                if auto_increment:
+                    # OR REPLACE: uma sobra de versões antigas não é reaproveitada com o contador avançado
+                    self.conn.execute(f"CREATE OR REPLACE SEQUENCE {self._q(sequence_name)} START 1;")
+                sql = f"CREATE TABLE {self._q(table_name)} ({', '.join(column_defs)});"
+                self.conn.execute(sql)
+
+                self.conn.execute(
+                    """
+                    INSERT INTO table_metadata (table_name, schema_json)
+                    VALUES (?, ?);
+                    """,
+                    (table_name, _json_dumps(metadata))
+                )
+                for field in fields:
+                    fk = field.get("foreign_key")
+                    if fk:
+                        fk_table = fk.get("table")
+                        fk_column = fk.get("column")
+                        self.conn.execute(
+                            """
+                            INSERT INTO fk_metadata (table_name, column_name, ref_table, ref_column)
+                            VALUES (?, ?, ?, ?)
+                            ON CONFLICT DO NOTHING;
+                            """,
+                            (table_name, field.get("name"), fk_table, fk_column)
+                        )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.invalidate_metadata_cache()
+            self.checkpoint()
+            return True
+        except Exception as e:
+            raise e
+
+    @_serialized
+    def add_column(self, table_name: str, field: dict):
+        try:
+            col_name = field.get("name")
+            if not col_name:
+                raise ValueError("Nome da coluna é obrigatório.")
+            data_type = field.get("data_type", "VARCHAR").strip() or "VARCHAR"
+            alter_sql = f"ALTER TABLE {self._q(table_name)} ADD COLUMN {self._q(col_name)} {data_type};"
+            self.conn.execute(alter_sql)
+            
+            # Cópia: o dict devolvido pertence ao cache de metadados
+            metadata = dict(self.get_table_metadata(table_name))
+            metadata[col_name] = {
+                "data_type": data_type,
+                "primary_key": field.get("primary_key", False),
+                "foreign_key": None
+            }
+            fk = field.get("foreign_key")
+            if fk:
+                fk_table = fk.get("table")
+                fk_column = fk.get("column")
+                if fk_table and fk_column:
+                    metadata[col_name]["foreign_key"] = {"table": fk_table, "column": fk_column}
+                    self.conn.execute(
+                        """
+                        INSERT INTO fk_metadata (table_name, column_name, ref_table, ref_column)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT DO NOTHING;
+                        """,
+                        (table_name, col_name, fk_table, fk_column)
+                    )
+            self.conn.execute(
+                "UPDATE table_metadata SET schema_json = ? WHERE table_name = ?;",
+                (_json_dumps(metadata), table_name)
+            )
+            self.invalidate_metadata_cache()
+            return True
+        except Exception as e:
+            raise e
+
+    def get_table_metadata(self, table_name: str):
+        try:
+            self._check_cache_version()
+            metadata = self._meta_cache.get(table_name)
+            if metadata is None:
+                with self._borrow() as cursor:
+                    row = cursor.execute(
+                        "SELECT schema_json FROM table_metadata WHERE table_name = ?",
+                        (table_name,)
+                    ).fetchone()
+                metadata = _json_loads(row[0]) if row else {}
+                self._meta_cache[table_name] = metadata
+            return metadata
+        except Exception as e:
+            st.error(f"Erro ao obter metadados: {str(e)}")
+            return {}
+
+    @_serialized
+    def insert_data(self, table_name: str, data: dict):
+        try:
+            metadata = self.get_table_metadata(table_name)
+            
+            # Validação de FK: todas as referências conferidas numa única consulta
+            fk_checks = [
+                (col, info["foreign_key"], data[col]) for col, info in metadata.items()
+                if info.get("foreign_key") and col in data and data[col] != ""
+            ]
+            if fk_checks:
+                selects = ", ".join(
+                    f"EXISTS (SELECT 1 FROM {self._q(fk.get('table'))} WHERE {self._q(fk.get('column'))} = ?)"
+                    for _, fk, _ in fk_checks
+                )
+                found = self.conn.execute(
+                    f"SELECT {selects}", [value for _, _, value in fk_checks]
+                ).fetchone()
+                for (col, fk, value), exists in zip(fk_checks, found):
+                    if not exists:
+                        st.error(f"Valor '{value}' para a coluna '{col}' não existe na tabela referenciada '{fk.get('table')}'.")
+                        return False
+
+            # PK com SEQUENCE vazia fica fora do INSERT para o DEFAULT nextval() preencher
+            data = {
+                col: value for col, value in data.items()
+                if value != "" or not metadata.get(col, {}).get("auto_increment")
+            }
+
+            # Validação de PK
+            primary_keys = [
+                col for col, info in metadata.items()
+                if info.get("primary_key") and not (info.get("auto_increment") and col not in data)
+            ]
+            if primary_keys:
+                missing = [pk for pk in primary_keys if not data.get(pk)]
+                if missing:
+                    st.error(f"Valores faltando para chave(s) primária(s): {', '.join(missing)}")
+                    return False
+
+            columns = ", ".join(self._q(c) for c in data.keys())
+            placeholders = ", ".join(["?"] * len(data))
+            sql = f"INSERT INTO {self._q(table_name)} ({columns}) VALUES ({placeholders})"
+
+            if primary_keys and not self._has_unique_constraint(table_name):
+                # PK só nos metadados (tabelas antigas sem a constraint): sem índice para o ON CONFLICT
+                conditions = " AND ".join(f"{self._q(pk)} = ?" for pk in primary_keys)
+                exists = self.conn.execute(
+                    f"SELECT 1 FROM {self._q(table_name)} WHERE {conditions}",
+                    [data[pk] for pk in primary_keys]
+                ).fetchone()
+                if exists:
+                    st.error("Registro com chave primária já existe.")
+                    return False
+                primary_keys = []
+
+            if not primary_keys:
+                self.conn.execute(sql, list(data.values()))
+                self._stats_cache.pop(table_name, None)
+                return True
+
+            # O índice da PK resolve a duplicidade no próprio INSERT
+            inserted = self.conn.execute(
+                f"{sql} ON CONFLICT DO NOTHING RETURNING 1",
+                list(data.values())
+            ).fetchone()
+            if not inserted:
+                st.error("Registro com chave primária já existe.")
+                return False
+            self._stats_cache.pop(table_name, None)
+            return True
+        except Exception as e:
+            st.error(f"Erro ao inserir: {str(e)}")
+            return False
+
+    @_serialized
+    def bulk_insert(self, table_name: str, rows):
+        """
+        Insere várias linhas como um lote Arrow, num único INSERT ... SELECT.
+        Aceita um pa.Table (registrado como está, sem passar por objetos Python) ou uma lista de dicts.
+        """
+        try:
+            if isinstance(rows, pa.Table):
+                batch = rows
+            else:
+                if not rows:
+                    return True
+                columns = list(rows[0].keys())
+                # Lote todo em texto (vazio vira NULL): tipos mistos não quebram a inferência do Arrow
+                batch = pa.Table.from_pylist(
+                    [
+                        {c: None if row.get(c) in (None, "") else str(row.get(c)) for c in columns}
+                        for row in rows
+                    ],
+                    schema=pa.schema([(c, pa.string()) for c in columns]),
+                )
+            if batch.num_rows == 0:
+                return True
+            metadata = self.get_table_metadata(table_name)
+            columns = batch.column_names
+            unknown = [c for c in columns if c not in metadata]
+            if unknown:
+                st.error(f"Colunas inexistentes em '{table_name}': {', '.join(unknown)}")
+                return False
+            # O CAST para o tipo dos metadados acontece no próprio SQL, qualquer que seja o tipo do lote
+            typed = "(SELECT " + ", ".join(
+                f"CAST({self._q(c)} AS {metadata[c]['data_type']}) AS {self._q(c)}" for c in columns
+            ) + " FROM __batch) b"
+            self.conn.register("__batch", batch)
+            try:
+                # FKs do lote inteiro conferidas numa única consulta
+                fk_checks = [
+                    (col, info["foreign_key"]) for col, info in metadata.items()
+                    if info.get("foreign_key") and col in columns
+                ]
+                if fk_checks:
+                    selects = ", ".join(
+                        f"(SELECT COUNT(*) FROM {typed} WHERE b.{self._q(col)} IS NOT NULL AND NOT EXISTS "
+                        f"(SELECT 1 FROM {self._q(fk.get('table'))} r WHERE r.{self._q(fk.get('column'))} = b.{self._q(col)}))"
+                        for col, fk in fk_checks
+                    )
+                    orphans = self.conn.execute(f"SELECT {selects}").fetchone()
+                    for (col, fk), missing in zip(fk_checks, orphans):
+                        if missing:
+                            st.error(f"{missing} valor(es) da coluna '{col}' não existem na tabela referenciada '{fk.get('table')}'.")
+                            return False
+
+                column_list = ", ".join(self._q(c) for c in columns)
+                sql = f"INSERT INTO {self._q(table_name)} ({column_list}) SELECT {column_list} FROM {typed}"
+                pk_columns = [c for c, info in metadata.items() if info.get("primary_key")]
+                if pk_columns and self._has_unique_constraint(table_name):
+                    # Duplicatas de PK são descartadas pelo índice, sem SELECT por linha
+                    sql += " ON CONFLICT DO NOTHING"
+                elif pk_columns and all(c in columns for c in pk_columns):
+                    # PK só nos metadados: o anti-join descarta as chaves que já estão na tabela
+                    match = " AND ".join(f"t.{self._q(c)} = b.{self._q(c)}" for c in pk_columns)
+                    sql += f" WHERE NOT EXISTS (SELECT 1 FROM {self._q(table_name)} t WHERE {match})"
+                self.conn.execute(sql)
+            finally:
+                self.conn.unregister("__batch")
+            self._stats_cache.pop(table_name, None)
+            self.checkpoint()
+            return True
+        except Exception as e:
+            st.error(f"Erro na inserção em lote: {str(e)}")
+            return False
+
+    @_serialized
+    def update_data(self, table_name: str, set_data: dict, where_clause: str, where_params: tuple):
+        try:
+            set_str = ", ".join([f"{self._q(col)} = ?" for col in set_data.keys()])
+            sql = f"UPDATE {self._q(table_name)} SET {set_str} WHERE {where_clause};"
+            values = tuple(set_data.values()) + where_params
+            self.conn.execute(sql, values)
+            self._stats_cache.pop(table_name, None)
+            return True
+        except Exception as e:
+            st.error(f"Erro na atualização: {str(e)}")
+            return False
+
+    @_serialized
+    def delete_data(self, table_name: str, where_clause: str, where_params: tuple):
+        try:
+            sql = f"DELETE FROM {self._q(table_name)} WHERE {where_clause};"
+            self.conn.execute(sql, where_params)
+            self._stats_cache.pop(table_name, None)
+            return True
+        except Exception as e:
+            st.error(f"Erro na deleção: {str(e)}")
+            return False
+
+    @_serialized
+    def delete_table(self, table_name: str):
+        try:
+            self.conn.execute(f"DROP TABLE IF EXISTS {self._q(table_name)};")
+            self.conn.execute(f"DROP SEQUENCE IF EXISTS {self._q(f'seq_{table_name}')};")
+            self.conn.execute("DELETE FROM table_metadata WHERE table_name = ?;", (table_name,))
+            self.conn.execute("DELETE FROM fk_metadata WHERE table_name = ?;", (table_name,))
+            self.invalidate_metadata_cache()
+            self.checkpoint()
+            return True
+        except Exception as e:
+            st.error(f"Erro ao dropar tabela: {str(e)}")
+            return False
+
+    def checkpoint(self, vacuum: bool = False) -> bool:
+        """
+        Grava o WAL no arquivo do banco; falha sem erro se houver transação aberta.
+        Com vacuum, o espaço livre fica disponível para novas escritas, mas o arquivo não encolhe.
+        """
+        try:
+            self.conn.execute("CHECKPOINT")
+            if vacuum:
+                self.conn.execute("VACUUM")
+            return True
+        except Exception as e:
+            logging.warning(f"Checkpoint não executado: {e}")
+            return False
+
+    @contextmanager
+    def read_cursor(self):
+        """Cursor do pool para leituras de quem está fora da classe (ex.: a sincronização)."""
+        with self._borrow() as cursor:
+            yield cursor
+
+    def list_physical_tables(self) -> list:
+        """Tabelas que existem no arquivo, registradas ou não nos metadados."""
+        with self._borrow() as cursor:
+            return [r[0] for r in cursor.execute("SHOW TABLES").fetchall()]
+
+    def list_tables(self):
+        try:
+            self._check_cache_version()
+            if self._tables_cache is None:
+                with self._borrow() as cursor:
+                    rows = cursor.execute("SELECT table_name FROM table_metadata;").fetchall()
+                self._tables_cache = [r[0] for r in rows]
+            return self._tables_cache
+        except Exception as e:
+            st.error(f"Erro ao listar tabelas: {str(e)}")
+            return []
+
+    def get_table_data(self, table_name: str, offset: int = 0, limit: int = PAGE_SIZE) -> pa.Table:
+        try:
+            with self._borrow() as cursor:
+                return cursor.execute(
+                    f"SELECT * FROM {self._q(table_name)} LIMIT ? OFFSET ?;",
+                    (limit, offset)
+                ).arrow()
+        except Exception as e:
+            st.error(f"Erro ao carregar dados: {str(e)}")
+            return pa.table({})
+
+    def export_table_csv(self, table_name: str):
+        """Tabela inteira em CSV, escrita pelo próprio DuckDB (COPY ... TO) sem passar pelo Python."""
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "export.csv")
+                target = path.replace("'", "''")
+                with self._borrow() as cursor:
+                    cursor.execute(f"COPY {self._q(table_name)} TO '{target}' (FORMAT CSV, HEADER)")
+                with open(path, "rb") as f:
+                    return f.read()
+        except Exception as e:
+            st.error(f"Erro ao exportar tabela: {str(e)}")
+            return None
+
+    def get_table_size_estimate(self, table_name: str) -> int:
+        try:
+            with self._borrow() as cursor:
+                row = cursor.execute(
+                    "SELECT estimated_size FROM duckdb_tables() WHERE table_name = ?",
+                    (table_name,)
+                ).fetchone()
+            return row[0] if row else 0
+        except Exception:
+            return 0
+
+    def get_table_stats(self, table_name: str):
+        try:
+            self._check_cache_version()
+            count = self._stats_cache.get(table_name)
+            if count is None:
+                with self._borrow() as cursor:
+                    count = cursor.execute(f"SELECT COUNT(*) FROM {self._q(table_name)}").fetchone()[0]
+                self._stats_cache[table_name] = count
+            return {"count": count}
+        except Exception:
+            return {"count": 0}
+
+    def get_all_table_stats(self, tables: list) -> dict:
+        """Contagem de linhas de várias tabelas num único UNION ALL."""
+        try:
+            self._check_cache_version()
+            missing = [t for t in tables if t not in self._stats_cache]
+            if missing:
+                parts = [f"SELECT ? AS n, COUNT(*) AS c FROM {self._q(t)}" for t in missing]
+                with self._borrow() as cursor:
+                    rows = cursor.execute(" UNION ALL ".join(parts), missing).fetchall()
+                self._stats_cache.update(dict(rows))
+            return {t: self._stats_cache.get(t, 0) for t in tables}
+        except Exception:
+            return {t: self.get_table_stats(t)["count"] for t in tables}
+
+    def get_column_counts(self) -> dict:
+        """Número de colunas por tabela, calculado pelo DuckDB sobre o schema_json."""
+        try:
+            self._check_cache_version()
+            if self._column_counts is None:
+                with self._borrow() as cursor:
+                    rows = cursor.execute(
+                        "SELECT table_name, json_array_length(json_keys(schema_json)) FROM table_metadata;"
+                    ).fetchall()
+                self._column_counts = dict(rows)
+            return self._column_counts
+        except Exception:
+            return {}
+
+    def _check_cache_version(self):
+        # Escritas de outro processo mudam o mtime do banco/WAL e descartam os caches
+        mtime = _db_mtime(self.db_path)
+        if mtime != self._cache_mtime:
+            self._meta_cache.clear()
+            self._stats_cache.clear()
+            self._tables_cache = None
+            self._column_counts = None
+            self._cache_mtime = mtime
+
+    def invalidate_metadata_cache(self):
+        self._tables_cache = None
+        self._column_counts = None
+        self._meta_cache.clear()
+        self._stats_cache.clear()
+
+
+# Versão dos caches em memória: o mtime do arquivo e do WAL muda a cada
+# escrita no banco (inclusive de outro processo)
+def _db_mtime(db_path: str) -> float:
+    mtimes = [os.path.getmtime(p) for p in (db_path, f"{db_path}.wal") if os.path.exists(p)]
+    return max(mtimes, default=0.0)
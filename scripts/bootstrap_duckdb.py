@@ -2,13 +2,13 @@
 
 from __future__ import annotations
 
-import json
 import logging
 import os
 from pathlib import Path
 from typing import Dict
 
 import duckdb
+import pyarrow as pa
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -88,6 +88,18 @@ SAMPLE_DATA = {
 }
 
 
+# Uma linha por coluna de FK; os dois unnest caminham juntos pelas listas da constraint
+_FK_COLUMNS_SQL = """
+    SELECT table_name,
+           unnest(constraint_column_names) AS column_name,
+           referenced_table AS ref_table,
+           unnest(referenced_column_names) AS ref_column
+    FROM duckdb_constraints()
+    WHERE database_name = current_database() AND schema_name = 'main'
+      AND constraint_type = 'FOREIGN KEY'
+"""
+
+
 def ensure_path() -> Path:
     path = Path(DESTINATION_PATH).expanduser().resolve()
     path.mkdir(parents=True, exist_ok=True)
@@ -100,14 +112,24 @@ def create_tables(conn: duckdb.DuckDBPyConnection) -> None:
     logger.info("Tabelas de exemplo criadas.")
 
 
-def seed_data(conn: duckdb.DuckDBPyConnection) -> None:
+def clear_data(conn: duckdb.DuckDBPyConnection) -> None:
+    # TRUNCATE descarta os row groups de uma vez, sem varrer e marcar linha a linha
     for table in reversed(list(SAMPLE_DATA.keys())):
-        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"TRUNCATE {table}")
+
+
+def seed_data(conn: duckdb.DuckDBPyConnection) -> None:
     for table, rows in SAMPLE_DATA.items():
         if not rows:
             continue
-        placeholders = ", ".join(["?"] * len(rows[0]))
-        conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+        # Lote Arrow registrado como view: um INSERT ... SELECT vetorizado por tabela,
+        # com as colunas na mesma ordem posicional das tuplas
+        batch = pa.table({f"c{i}": list(values) for i, values in enumerate(zip(*rows))})
+        conn.register("seed_batch", batch)
+        try:
+            conn.execute(f"INSERT INTO {table} SELECT * FROM seed_batch")
+        finally:
+            conn.unregister("seed_batch")
     logger.info("Dados de exemplo inseridos.")
 
 
@@ -132,45 +154,47 @@ def ensure_metadata_tables(conn: duckdb.DuckDBPyConnection) -> None:
         """
     )
 
-    tables = conn.execute("SHOW TABLES").fetchall()
-    for (table,) in tables:
-        if table in ("table_metadata", "fk_metadata"):
-            continue
-        columns_info = conn.execute(f"PRAGMA table_info('{table}')").fetchall()
-        metadata: Dict[str, Dict[str, object]] = {}
-        for col in columns_info:
-            metadata[col[1]] = {
-                "data_type": col[2],
-                "primary_key": bool(col[5]),
-                "foreign_key": None,
-            }
-        try:
-            fk_info = conn.execute(f"PRAGMA foreign_key_list('{table}')").fetchall()
-        except Exception:
-            fk_info = []
-        for fk in fk_info:
-            fk_column = fk[3]
-            ref_table = fk[2]
-            ref_column = fk[4]
-            metadata[fk_column]["foreign_key"] = {"table": ref_table, "column": ref_column}
-            conn.execute(
-                """
-                INSERT INTO fk_metadata (table_name, column_name, ref_table, ref_column)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT (table_name, column_name) DO UPDATE SET
-                    ref_table = excluded.ref_table,
-                    ref_column = excluded.ref_column;
-                """,
-                (table, fk_column, ref_table, ref_column),
-            )
-        conn.execute(
-            """
-            INSERT INTO table_metadata (table_name, schema_json)
-            VALUES (?, ?)
-            ON CONFLICT (table_name) DO UPDATE SET schema_json = excluded.schema_json;
-            """,
-            (table, json.dumps(metadata)),
-        )
+    # Colunas, PKs e FKs saem do catálogo e o JSON é montado pelo próprio DuckDB:
+    # duas instruções para o banco inteiro, sem laço por tabela no Python
+    conn.execute(
+        f"""
+        INSERT INTO fk_metadata (table_name, column_name, ref_table, ref_column)
+        {_FK_COLUMNS_SQL}
+        ON CONFLICT (table_name, column_name) DO UPDATE SET
+            ref_table = excluded.ref_table,
+            ref_column = excluded.ref_column;
+        """
+    )
+    conn.execute(
+        f"""
+        INSERT INTO table_metadata (table_name, schema_json)
+        WITH pks AS (
+            SELECT table_name, unnest(constraint_column_names) AS column_name
+            FROM duckdb_constraints()
+            WHERE database_name = current_database() AND schema_name = 'main'
+              AND constraint_type = 'PRIMARY KEY'
+        ),
+        fks AS ({_FK_COLUMNS_SQL})
+        SELECT
+            c.table_name,
+            '{{' || string_agg(
+                to_json(c.column_name) || ':' || to_json(struct_pack(
+                    data_type := c.data_type,
+                    primary_key := pks.column_name IS NOT NULL,
+                    foreign_key := CASE WHEN fks.ref_table IS NOT NULL
+                        THEN struct_pack("table" := fks.ref_table, "column" := fks.ref_column) END
+                )),
+                ',' ORDER BY c.column_index
+            ) || '}}'
+        FROM duckdb_columns() c
+        LEFT JOIN pks USING (table_name, column_name)
+        LEFT JOIN fks USING (table_name, column_name)
+        WHERE c.database_name = current_database() AND c.schema_name = 'main' AND NOT c.internal
+          AND c.table_name NOT IN ('table_metadata', 'fk_metadata')
+        GROUP BY c.table_name
+        ON CONFLICT (table_name) DO UPDATE SET schema_json = excluded.schema_json;
+        """
+    )
     logger.info("Metadados sincronizados.")
 
 
@@ -180,8 +204,17 @@ def main() -> None:
     conn = duckdb.connect(str(database_path))
     try:
         create_tables(conn)
-        seed_data(conn)
-        ensure_metadata_tables(conn)
+        # O DuckDB recusa apagar (DELETE ou TRUNCATE) linhas referenciadas por FK
+        # dentro da mesma transação, então a limpeza roda antes; o restante vira um único commit
+        clear_data(conn)
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            seed_data(conn)
+            ensure_metadata_tables(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
     finally:
         conn.close()
     logger.info("Arquivo DuckDB pronto para uso.")
@@ -1,35 +1,82 @@
+import atexit
 import duckdb
+import functools
+import graphlib
+import io
+import itertools
+import json
 import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import logging
-import json
-import time
 import os
-import sys
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.thread import BrokenThreadPool
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
 from pathlib import Path
-from collections import defaultdict, deque
-from typing import Dict, List, Optional, Sequence, Tuple, Any
+from typing import Dict, List, Optional, Tuple
 from psycopg2.extras import execute_values
 from psycopg2 import sql
 from abc import ABC, abstractmethod
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("pipeline.log"), logging.StreamHandler()],
-)
 logger = logging.getLogger(__name__)
 
+
+def configure_logging() -> None:
+    """
+    Logs da execução via linha de comando. As threads de carga só enfileiram o registro
+    já formatado; arquivo e console são escritos pela thread do QueueListener, fora do
+    caminho do COPY. Chamado pelo main(): importar o módulo (app, testes) não cria
+    o pipeline.log nem inicia a thread.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, logging.FileHandler("pipeline.log"), logging.StreamHandler())
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[QueueHandler(log_queue)],
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
 load_dotenv()
 
 # Constantes Globais
-DUCKDB_PATH = os.getenv("DUCKDB_PATH")
-DESTINATION_PATH = os.getenv("DESTINATION_PATH")
+DUCKDB_PATH = os.getenv("DUCKDB_PATH", "database.duckdb")
+DESTINATION_PATH = os.getenv("DESTINATION_PATH", "./data")
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", "5000"))
 TRUNCATE_BEFORE_LOAD = os.getenv("TRUNCATE_BEFORE_LOAD", "false").lower() == "true"
 DESTINATION_TYPE = os.getenv("DESTINATION_TYPE", "SUPABASE").upper() # SUPABASE, DATABRICKS, S3
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "4"))
+# Lotes já convertidos em CSV aguardando o COPY: limita a memória a BATCH_SIZE × PREFETCH_BATCHES linhas
+PREFETCH_BATCHES = 4
+# Teto de marcadores por INSERT no Databricks: o lote encolhe conforme o número de colunas
+DATABRICKS_MAX_PARAMS = 2000
+
+# O loader só lê do DuckDB: mesmos limites do app, com varredura em todos os núcleos permitidos
+DUCKDB_CONFIG = {
+    "threads": os.getenv("DUCKDB_THREADS", str(os.cpu_count() or 4)),
+    "memory_limit": os.getenv("DUCKDB_MEMORY_LIMIT", "2GB"),
+}
+
+# Tipos (cursor.description do DuckDB) que o CSV do Arrow não representa no formato do Postgres
+COPY_UNSUPPORTED_TYPES = {"BINARY", "TIMEDELTA", "list", "dict"}
+
+# Tipos do DuckDB sem equivalente direto no Postgres; os demais passam como estão
+DUCKDB_TO_POSTGRES_TYPES = {
+    "TINYINT": "SMALLINT",
+    "UTINYINT": "SMALLINT",
+    "BLOB": "BYTEA",
+    "DOUBLE": "DOUBLE PRECISION",
+    "DECIMAL": "NUMERIC",
+}
 
 TIMESTAMP_CANDIDATES = [
     "updated_at", "updated_on", "modified_at", "modified_on",
@@ -37,6 +84,68 @@ TIMESTAMP_CANDIDATES = [
     "ts_update", "dt_update", "ultima_atualizacao", "data_atualizacao",
 ]
 
+
+def mapear_tipo_duckdb_para_postgres_type(duck_type: str) -> str:
+    """Traduz o tipo de uma coluna DuckDB com uma consulta ao dicionário, mantendo parâmetros como (10,2)."""
+    t = duck_type.strip().upper()
+    base, sep, params = t.partition("(")
+    mapped = DUCKDB_TO_POSTGRES_TYPES.get(base.strip())
+    if mapped is None:
+        return t
+    return f"{mapped}{sep}{params}"
+
+
+# ==============================================================================
+# AUXILIARES
+# ==============================================================================
+
+def buscar_em_segundo_plano(iteravel, profundidade: int = PREFETCH_BATCHES):
+    """
+    Consome o iterável numa thread auxiliar e entrega os itens pela fila, para que
+    a leitura do próximo lote se sobreponha ao envio do atual.
+    """
+    fila = queue.Queue(maxsize=profundidade)
+    parar = threading.Event()
+    fim = object()
+
+    def enfileirar(item) -> bool:
+        while not parar.is_set():
+            try:
+                fila.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produzir():
+        try:
+            for item in iteravel:
+                if not enfileirar((item, None)):
+                    return
+            enfileirar((fim, None))
+        except Exception as e:
+            enfileirar((fim, e))
+
+    produtor = threading.Thread(target=produzir, daemon=True)
+    produtor.start()
+    try:
+        while True:
+            item, erro = fila.get()
+            if erro is not None:
+                raise erro
+            if item is fim:
+                return
+            yield item
+    finally:
+        # Consumidor saiu (fim ou erro no COPY): libera o produtor e espera ele terminar
+        parar.set()
+        while produtor.is_alive():
+            try:
+                fila.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
 # ==============================================================================
 # CLASSES DE ESTRATÉGIA (STRATEGY PATTERN)
 # ==============================================================================
@@ -69,6 +178,10 @@ class DestinationStrategy(ABC):
         """Carrega os dados efetivamente."""
         pass
 
+    def rollback(self) -> None:
+        """Descarta a transação aberta no destino (destinos sem transação não fazem nada)."""
+        pass
+
 
 class SupabaseStrategy(DestinationStrategy):
     """Implementação para PostgreSQL / Supabase."""
@@ -82,6 +195,9 @@ class SupabaseStrategy(DestinationStrategy):
         self.sslmode = os.getenv("DB_SSLMODE")
         self.sslrootcert = os.getenv("DB_SSLROOTCERT")
         self.conn = None
+        self.existing_tables = set()
+        # Tabelas truncadas nesta execução: a carga não tem linha antiga com que conflitar
+        self.conflict_free_tables = set()
         
         # Validação básica
         if not all([self.host, self.dbname, self.user]):
@@ -90,13 +206,16 @@ class SupabaseStrategy(DestinationStrategy):
     def connect(self):
         params = {
             "host": self.host, "database": self.dbname, "user": self.user,
-            "password": self.password, "port": self.port
+            "password": self.password, "port": self.port,
+            # Keepalive de TCP: COPYs longos atravessam o pooler/NAT sem conexão derrubada por ociosidade
+            "keepalives": 1, "keepalives_idle": 30, "keepalives_interval": 10, "keepalives_count": 5,
         }
         if self.sslmode: params["sslmode"] = self.sslmode
         if self.sslrootcert: params["sslrootcert"] = self.sslrootcert
         
         self.conn = psycopg2.connect(**params)
         self._setup_control_table()
+        self._load_existing_tables()
 
     def close(self):
         if self.conn:
@@ -113,92 +232,200 @@ class SupabaseStrategy(DestinationStrategy):
             """)
             self.conn.commit()
 
+    def _load_existing_tables(self):
+        # Uma consulta por conexão no lugar de um to_regclass por tabela
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()"
+            )
+            self.existing_tables = {row[0] for row in cur.fetchall()}
+        self.conn.commit()
+
     def get_last_sync_info(self, table_name: str) -> Optional[datetime]:
+        # Tabela removida no destino volta por carga completa, mesmo com o controle antigo ainda lá
+        if table_name not in self.existing_tables:
+            return None
         with self.conn.cursor() as cur:
             cur.execute("SELECT ultima_carga FROM controle_cargas WHERE tabela_nome = %s", (table_name,))
             row = cur.fetchone()
             return row[0] if row else None
 
+    def rollback(self) -> None:
+        self.conn.rollback()
+
     def prepare_table(self, table_name: str, schema: List[Tuple], pk_columns: List[str], fk_info: List[Tuple]) -> None:
+        # Sem commit aqui: DDL, TRUNCATE e carga fecham numa única transação em load_data
+        try:
+            self._prepare_table(table_name, schema, pk_columns)
+            if TRUNCATE_BEFORE_LOAD:
+                self.conflict_free_tables.add(table_name)
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def _prepare_table(self, table_name: str, schema: List[Tuple], pk_columns: List[str]) -> None:
         with self.conn.cursor() as cur:
-            # 1. Verifica se tabela existe
-            cur.execute(sql.SQL("SELECT to_regclass({})").format(sql.Literal(table_name)))
-            exists = cur.fetchone()[0] is not None
+            # Vale só para a transação da tabela: o commit final não espera o flush do WAL.
+            # Uma queda do servidor perde carga e controle_cargas juntos, e a próxima execução refaz
+            cur.execute("SET LOCAL synchronous_commit = off")
 
-            if not exists:
+            # 1. Verifica se tabela existe
+            if table_name not in self.existing_tables:
                 logger.info(f"[Supabase] Criando tabela {table_name}")
                 cols = []
                 for col in schema:
-                    pg_type = self._map_type(col[1])
-                    cols.append(f'"{col[0]}" {pg_type}')
+                    pg_type = mapear_tipo_duckdb_para_postgres_type(col[1])
+                    cols.append(sql.SQL("{} {}").format(sql.Identifier(col[0]), sql.SQL(pg_type)))
                 
                 if pk_columns:
-                    cols.append(f"PRIMARY KEY ({', '.join([f'{c}' for c in pk_columns])})")
+                    cols.append(sql.SQL("PRIMARY KEY ({})").format(
+                        sql.SQL(", ").join(sql.Identifier(c) for c in pk_columns)
+                    ))
                 
-                create_sql = f"CREATE TABLE {table_name} ({', '.join(cols)});"
+                create_sql = sql.SQL("CREATE TABLE {} ({})").format(
+                    sql.Identifier(table_name), sql.SQL(", ").join(cols)
+                )
                 cur.execute(create_sql)
                 # Registra no controle
-                cur.execute("INSERT INTO controle_cargas (tabela_nome, linhas_carregadas) VALUES (%s, 0)", (table_name,))
+                cur.execute(
+                    """
+                    INSERT INTO controle_cargas (tabela_nome, linhas_carregadas) VALUES (%s, 0)
+                    ON CONFLICT (tabela_nome) DO UPDATE SET ultima_carga = NULL, linhas_carregadas = 0
+                    """,
+                    (table_name,),
+                )
+                self.existing_tables.add(table_name)
             
             # (Opcional) Aqui iria a lógica de verificar constraints/FKs existente no código original
             # Simplificado para manter o foco na estrutura
-            self.conn.commit()
 
             if TRUNCATE_BEFORE_LOAD:
-                cur.execute(f"TRUNCATE TABLE {table_name} RESTART IDENTITY CASCADE;")
-                self.conn.commit()
+                cur.execute(
+                    sql.SQL("TRUNCATE TABLE {} RESTART IDENTITY CASCADE").format(sql.Identifier(table_name))
+                )
 
     def load_data(self, table_name: str, data_iterator, columns: List[str], ts_column: str) -> int:
+        try:
+            if any(d[1] in COPY_UNSUPPORTED_TYPES for d in data_iterator.description):
+                return self._load_values(table_name, data_iterator, columns, ts_column)
+            return self._load_copy(table_name, data_iterator, columns, ts_column)
+        except Exception:
+            # Transação abortada não pode vazar para a próxima tabela da mesma conexão
+            self.conn.rollback()
+            raise
+
+    def _load_copy(self, table_name: str, data_iterator, columns: List[str], ts_column: str) -> int:
+        """
+        Lotes Arrow do DuckDB viram CSV no próprio Arrow e entram via COPY numa
+        tabela temporária; o INSERT final mantém o ON CONFLICT DO NOTHING.
+        Tabela recém-truncada recebe o COPY direto, sem staging.
+        """
         total_inserted = 0
         max_ts = None
-        
-        col_names = [f'"{c}"' for c in columns]
-        query = f"INSERT INTO {table_name} ({', '.join(col_names)}) VALUES %s ON CONFLICT DO NOTHING"
+
+        table = sql.Identifier(table_name)
+        staging = sql.Identifier(f"_stg_{table_name}")
+        col_list = sql.SQL(", ").join(sql.Identifier(c) for c in columns)
+
+        use_staging = table_name not in self.conflict_free_tables
 
         with self.conn.cursor() as cur:
-            while True:
-                batch = data_iterator.fetchmany(BATCH_SIZE)
-                if not batch:
-                    break
-                
-                execute_values(cur, query, batch, page_size=BATCH_SIZE)
+            if use_staging:
+                cur.execute(
+                    sql.SQL("CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP").format(staging, table)
+                )
+            copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT CSV)").format(
+                staging if use_staging else table, col_list
+            ).as_string(cur)
+
+            # Leitura do DuckDB e serialização CSV correm em outra thread enquanto o COPY envia
+            for buffer, num_rows, batch_max in buscar_em_segundo_plano(
+                self._csv_batches(data_iterator, ts_column)
+            ):
+                cur.copy_expert(copy_sql, buffer)
+                total_inserted += num_rows
+                if batch_max is not None and (max_ts is None or batch_max > max_ts):
+                    max_ts = batch_max
+
+            if total_inserted > 0:
+                if use_staging:
+                    cur.execute(
+                        sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT DO NOTHING").format(
+                            table, col_list, col_list, staging
+                        )
+                    )
+                self._update_control(cur, table_name, max_ts, total_inserted)
+            # Commit único por tabela, também com zero linhas para fechar o DDL de prepare_table
+            self.conn.commit()
+
+        return total_inserted
+
+    @staticmethod
+    def _csv_batches(data_iterator, ts_column: str):
+        """Converte cada lote Arrow em CSV, junto com a contagem e o maior timestamp do lote."""
+        write_options = pacsv.WriteOptions(include_header=False)
+        for batch in data_iterator.fetch_record_batch(BATCH_SIZE):
+            if batch.num_rows == 0:
+                continue
+            buffer = io.BytesIO()
+            pacsv.write_csv(pa.Table.from_batches([batch]), buffer, write_options)
+            buffer.seek(0)
+            batch_max = pc.max(batch.column(ts_column)).as_py() if ts_column else None
+            yield buffer, batch.num_rows, batch_max
+
+    def _load_values(self, table_name: str, data_iterator, columns: List[str], ts_column: str) -> int:
+        total_inserted = 0
+        max_ts = None
+        
+        with self.conn.cursor() as cur:
+            # Identificadores citados pelo psycopg2; execute_values recebe a string já montada
+            conflict = sql.SQL("") if table_name in self.conflict_free_tables else sql.SQL(" ON CONFLICT DO NOTHING")
+            query = sql.SQL("INSERT INTO {} ({}) VALUES %s{}").format(
+                sql.Identifier(table_name),
+                sql.SQL(", ").join(sql.Identifier(c) for c in columns),
+                conflict,
+            ).as_string(cur)
+            # Template e posição do timestamp fixos para a tabela inteira, fora do laço de lotes
+            template = "(" + ",".join(["%s"] * len(columns)) + ")"
+            ts_idx = columns.index(ts_column) if ts_column else None
+            # Mesmo produtor do COPY: o próximo fetchmany corre enquanto o lote atual é enviado
+            for batch in buscar_em_segundo_plano(iter(lambda: data_iterator.fetchmany(BATCH_SIZE), [])):
+                execute_values(cur, query, batch, template=template, page_size=BATCH_SIZE)
                 total_inserted += len(batch)
 
-                # Calcular Max Timestamp do lote
-                if ts_column:
-                    try:
-                        idx = columns.index(ts_column)
-                        batch_max = max(row[idx] for row in batch if row[idx])
-                        if max_ts is None or batch_max > max_ts:
-                            max_ts = batch_max
-                    except:
-                        pass # Falha segura se timestamp não for comparável
+                # Calcular Max Timestamp do lote; nulos ficam de fora, sem try/except no laço
+                if ts_idx is not None:
+                    for row in batch:
+                        value = row[ts_idx]
+                        if value is not None and (max_ts is None or value > max_ts):
+                            max_ts = value
         
             if total_inserted > 0:
-                self._update_control(table_name, max_ts, total_inserted)
-                self.conn.commit()
-            
+                self._update_control(cur, table_name, max_ts, total_inserted)
+            # Commit único por tabela, também com zero linhas para fechar o DDL de prepare_table
+            self.conn.commit()
+
         return total_inserted
 
-    def _update_control(self, table, last_ts, count):
-        with self.conn.cursor() as cur:
-            if last_ts:
-                cur.execute(
-                    "UPDATE controle_cargas SET ultima_carga = %s, linhas_carregadas = COALESCE(linhas_carregadas,0) + %s WHERE tabela_nome = %s",
-                    (last_ts, count, table)
-                )
-            else:
-                 cur.execute(
-                    "UPDATE controle_cargas SET linhas_carregadas = COALESCE(linhas_carregadas,0) + %s WHERE tabela_nome = %s",
-                    (count, table)
-                )
+    @staticmethod
+    def _update_control(cur, table, last_ts, count):
+        # Mesmo cursor e transação da carga; sem timestamp novo, COALESCE mantém o anterior
+        cur.execute(
+            "UPDATE controle_cargas SET ultima_carga = COALESCE(%s, ultima_carga), "
+            "linhas_carregadas = COALESCE(linhas_carregadas,0) + %s WHERE tabela_nome = %s",
+            (last_ts, count, table)
+        )
 
-    def _map_type(self, duck_type: str) -> str:
-        t = duck_type.upper()
-        if "TINYINT" in t: return "SMALLINT"
-        if "BLOB" in t: return "BYTEA"
-        if "DOUBLE" in t: return "DOUBLE PRECISION"
-        return t
+
+@functools.lru_cache(maxsize=8)
+def marcadores_databricks(n_rows: int, n_cols: int) -> Tuple[str, Tuple[str, ...]]:
+    """Monta (uma vez por formato de lote) o VALUES com marcadores nomeados e a ordem dos nomes."""
+    names = tuple(f"p{i}_{j}" for i in range(n_rows) for j in range(n_cols))
+    rows = (
+        "(" + ", ".join(f":{name}" for name in names[i * n_cols:(i + 1) * n_cols]) + ")"
+        for i in range(n_rows)
+    )
+    return ", ".join(rows), names
 
 
 class DatabricksStrategy(DestinationStrategy):
@@ -208,8 +435,9 @@ class DatabricksStrategy(DestinationStrategy):
     """
     def __init__(self):
         try:
-            from databricks import sql
-            self.sql_module = sql
+            # Alias para não sombrear o psycopg2.sql do módulo
+            from databricks import sql as databricks_sql
+            self.sql_module = databricks_sql
         except ImportError:
             raise ImportError("Instale 'databricks-sql-connector' para usar este destino.")
         
@@ -244,7 +472,10 @@ class DatabricksStrategy(DestinationStrategy):
 
     def get_last_sync_info(self, table_name: str) -> Optional[datetime]:
         with self.conn.cursor() as cur:
-            cur.execute(f"SELECT max(ultima_carga) FROM controle_cargas WHERE tabela_nome = '{table_name}'")
+            cur.execute(
+                "SELECT max(ultima_carga) FROM controle_cargas WHERE tabela_nome = :tabela",
+                {"tabela": table_name},
+            )
             row = cur.fetchone()
             return row[0] if row else None
 
@@ -252,30 +483,26 @@ class DatabricksStrategy(DestinationStrategy):
         with self.conn.cursor() as cur:
             cols = []
             for col in schema:
-                cols.append(f"{col[0]} {col[1]}")
+                cols.append(f"`{col[0]}` {col[1]}")
             
-            sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(cols)}) USING DELTA;"
-            cur.execute(sql)
+            ddl = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(cols)}) USING DELTA;"
+            cur.execute(ddl)
 
     def load_data(self, table_name: str, data_iterator, columns: List[str], ts_column: str) -> int:
         # Em produção use COPY INTO do S3.
         total = 0
+        insert_prefix = f"INSERT INTO {table_name} ({', '.join(f'`{c}`' for c in columns)}) VALUES "
+        rows_per_stmt = max(1, min(BATCH_SIZE, DATABRICKS_MAX_PARAMS // len(columns)))
         with self.conn.cursor() as cur:
             while True:
-                batch = data_iterator.fetchmany(BATCH_SIZE)
+                batch = data_iterator.fetchmany(rows_per_stmt)
                 if not batch: break
-                
-                values_str = []
-                for row in batch:
-                    # Tratamento básico
-                    row_fmt = [f"'{str(v)}'" if isinstance(v, (str, datetime)) else str(v) for v in row]
-                    values_str.append(f"({', '.join(row_fmt)})")
-                
-                if values_str:
-                    sql = f"INSERT INTO {table_name} VALUES {','.join(values_str)}"
-                    cur.execute(sql)
-                    total += len(batch)
-        
+
+                # Parâmetros nativos do conector: o driver serializa os valores, sem montar literais no Python
+                placeholders, names = marcadores_databricks(len(batch), len(columns))
+                params = dict(zip(names, itertools.chain.from_iterable(batch)))
+                cur.execute(insert_prefix + placeholders, params)
+                total += len(batch)
 
         return total
 
@@ -284,6 +511,9 @@ class S3ParquetStrategy(DestinationStrategy):
     """
     Implementação para Data Lake (S3).
     Usa o poder do DuckDB para exportar direto para Parquet/S3 via HTTPFS.
+
+    Layout: s3://<bucket>/raw/<tabela>/dt=<AAAA-MM-DD>/run=<HHMMSS>/data_N.parquet.
+    Cada execução grava numa pasta run= própria; leitores usam a run= mais recente do dia.
     """
     def __init__(self, local_duckdb_conn):
         self.bucket = os.getenv("S3_BUCKET_NAME")
@@ -313,21 +543,22 @@ class S3ParquetStrategy(DestinationStrategy):
     def load_data(self, table_name: str, data_iterator, columns: List[str], ts_column: str) -> int:
         # Iteramos com DuckDB
         
-        date_partition = datetime.now().strftime('%Y-%m-%d')
-        s3_path = f"s3://{self.bucket}/raw/{table_name}/dt={date_partition}/data.parquet"
+        now = datetime.now()
+        # Pasta exclusiva da execução: arquivos data_N de uma carga anterior no mesmo dia
+        # não se misturam com os novos (OVERWRITE_OR_IGNORE não remove os que sobram)
+        s3_path = f"s3://{self.bucket}/raw/{table_name}/dt={now:%Y-%m-%d}/run={now:%H%M%S}"
         
         logger.info(f"[S3] Exportando {table_name} diretamente para {s3_path}...")
         
-        
+        # Um arquivo por thread do DuckDB: compressão e upload em paralelo, em vez de um único PUT
         query = f"""
             COPY (SELECT * FROM {table_name}) 
             TO '{s3_path}' 
-            (FORMAT PARQUET, COMPRESSION ZSTD, OVERWRITE_OR_IGNORE);
+            (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 122880,
+             PER_THREAD_OUTPUT TRUE, OVERWRITE_OR_IGNORE);
         """
-        self.duck.execute(query)
-        
-        # Conta linhas copiadas (meta-dado do arquivo ou count simples)
-        count = self.duck.execute(f"SELECT count(*) FROM read_parquet('{s3_path}')").fetchone()[0]
+        # O próprio COPY devolve a quantidade de linhas gravadas: nada de reler o Parquet no S3
+        count = self.duck.execute(query).fetchone()[0]
         logger.info(f"[S3] Exportação concluída: {count} registros.")
         return count
 
@@ -340,7 +571,8 @@ def get_duckdb_conn():
     full_path = (Path(DESTINATION_PATH) / DUCKDB_PATH).resolve()
     if not full_path.exists():
          raise FileNotFoundError(f"DB não encontrado: {full_path}")
-    return duckdb.connect(str(full_path))
+    # Somente leitura: sem escrita de WAL, e os cursores das threads compartilham a instância
+    return duckdb.connect(str(full_path), read_only=True, config=DUCKDB_CONFIG)
 
 def get_strategy(local_conn) -> DestinationStrategy:
     """Factory que retorna a estratégia correta baseada no .env"""
@@ -353,62 +585,203 @@ def get_strategy(local_conn) -> DestinationStrategy:
     else:
         raise ValueError(f"Tipo de destino desconhecido: {DESTINATION_TYPE}")
 
-def main():
-    start_time = datetime.now()
-    logger.info(f"Iniciando Pipeline. Destino: {DESTINATION_TYPE}")
+def agrupar_tabelas_por_nivel(tabelas: List[str], metadata: Dict[str, object]) -> List[List[str]]:
+    """
+    Agrupa as tabelas em níveis pelas FKs: cada nível só referencia tabelas
+    de níveis anteriores. Aceita o schema_json já decodificado ou em texto.
+    Com ciclo, cai para uma tabela por nível na ordem original.
+    """
+    dependencias = {t: set() for t in tabelas}
+    for tabela in tabelas:
+        schema = metadata.get(tabela) or {}
+        if isinstance(schema, str):
+            schema = json.loads(schema)
+        for info in schema.values():
+            fk = (info or {}).get("foreign_key")
+            if fk and fk.get("table") in dependencias and fk.get("table") != tabela:
+                dependencias[tabela].add(fk["table"])
+
+    sorter = graphlib.TopologicalSorter(dependencias)
+    try:
+        sorter.prepare()
+    except graphlib.CycleError:
+        logger.warning("Ciclo de FKs detectado; mantendo a ordem original das tabelas.")
+        return [[t] for t in tabelas]
 
-    # 1. Conexões
-    duck_conn = get_duckdb_conn()
-    
+    posicao = {t: i for i, t in enumerate(tabelas)}
+    niveis = []
+    while sorter.is_active():
+        prontas = sorted(sorter.get_ready(), key=posicao.__getitem__)
+        niveis.append(prontas)
+        sorter.done(*prontas)
+    return niveis
+
+
+def ordenar_tabelas_topologicamente(tabelas: List[str], metadata: Dict[str, object]) -> List[str]:
+    """Ordena as tabelas para que as referenciadas por FK sejam carregadas antes."""
+    return [t for nivel in agrupar_tabelas_por_nivel(tabelas, metadata) for t in nivel]
+
+
+def carregar_schemas(duck_conn) -> Dict[str, Tuple[List[Tuple], List[str]]]:
+    """Colunas e PKs de todas as tabelas em duas consultas ao catálogo do DuckDB."""
+    schemas = {}
+    for table, column, data_type in duck_conn.execute(
+        """
+        SELECT table_name, column_name, data_type
+        FROM duckdb_columns()
+        WHERE schema_name = 'main' AND database_name = current_database() AND NOT internal
+        ORDER BY table_name, column_index
+        """
+    ).fetchall():
+        schemas.setdefault(table, ([], []))[0].append((column, data_type))
+
+    for table, pk_columns in duck_conn.execute(
+        """
+        SELECT table_name, constraint_column_names
+        FROM duckdb_constraints()
+        WHERE schema_name = 'main' AND database_name = current_database() AND constraint_type = 'PRIMARY KEY'
+        """
+    ).fetchall():
+        if table in schemas:
+            schemas[table][1].extend(pk_columns)
+    return schemas
+
+
+def processar_tabela(table: str, destination: DestinationStrategy, duck_conn, schema: List[Tuple], pks: List[str]) -> None:
     try:
-        destination = get_strategy(duck_conn)
-        destination.connect()
+        cols = [c[0] for c in schema]
+        
+        last_sync = destination.get_last_sync_info(table)
+        ts_col = next((c for c in cols if c in TIMESTAMP_CANDIDATES), None)
+        
+        query = f"SELECT * FROM {table}"
+        params = []
+        
+        if ts_col and last_sync and not TRUNCATE_BEFORE_LOAD:
+            # Um max() no DuckDB evita staging, COPY e commit no destino quando nada mudou
+            has_new = duck_conn.execute(
+                f"SELECT coalesce(max({ts_col}) > ?, false) FROM {table}", [last_sync]
+            ).fetchone()[0]
+            if not has_new:
+                logger.info(f"[{table}] Sem alterações desde {last_sync}. Tabela ignorada.")
+                # Encerra a transação aberta pela consulta ao controle: a conexão não fica ociosa nela
+                destination.rollback()
+                return
+            logger.info(f"[{table}] Modo Incremental. Novos dados desde {last_sync}")
+            query += f" WHERE {ts_col} > ?"
+            params.append(last_sync)
+        else:
+            logger.info(f"[{table}] Modo Full Load")
+
+        # Depois do atalho acima: tabela sem mudanças não abre DDL pendente no destino
+        destination.prepare_table(table, schema, pks, [])
+        try:
+            # Executar Carga
+            cursor = duck_conn.execute(query, params)
+            count = destination.load_data(table, cursor, cols, ts_col)
+        except Exception:
+            # DDL/TRUNCATE pendentes não podem ser confirmados junto com a próxima tabela
+            destination.rollback()
+            raise
+        logger.info(f"[{table}] Sucesso. {count} linhas sincronizadas.")
+
     except Exception as e:
-        logger.error(f"Erro fatal na conexão com destino: {e}")
-        return
+        logger.error(f"Erro ao processar tabela {table}: {e}")
+
+
+def run(duck_conn, timeout: Optional[float] = None) -> None:
+    """
+    Executa a carga usando uma conexão DuckDB já aberta (não a fecha).
+    Com timeout (segundos), nenhuma tabela nova é iniciada depois do prazo.
+    """
+    start_time = datetime.now()
+    logger.info(f"Iniciando Pipeline. Destino: {DESTINATION_TYPE}")
+    prazo = time.monotonic() + timeout if timeout else None
+
+    def dentro_do_prazo(table: str) -> bool:
+        if prazo is not None and time.monotonic() > prazo:
+            logger.error(f"Tempo limite de {timeout}s excedido: tabela {table} não processada.")
+            return False
+        return True
+
+    destination = None
+    # Cada thread de carga tem seu cursor DuckDB e sua conexão com o destino,
+    # abertos uma vez e reaproveitados entre as tabelas que ela processar
+    local = threading.local()
+    abertos = []
+    erros_conexao = []
+
+    def abrir_destino_da_thread():
+        try:
+            local.duck = duck_conn.cursor()
+            local.destination = get_strategy(local.duck)
+            abertos.append((local.destination, local.duck))
+            local.destination.connect()
+        except Exception as e:
+            # O executor só repassa BrokenThreadPool: a causa real fica guardada para o log
+            erros_conexao.append(e)
+            raise
+
+    def processar_na_thread(table: str) -> None:
+        if dentro_do_prazo(table):
+            processar_tabela(table, local.destination, local.duck, *schemas[table])
 
     try:
         tables = [t[0] for t in duck_conn.execute("SHOW TABLES").fetchall()]
         if "table_metadata" in tables: tables.remove("table_metadata")
         if "fk_metadata" in tables: tables.remove("fk_metadata")
+
+        # schema_json decodificado uma única vez para o grafo de dependências
+        try:
+            metadata = {
+                name: json.loads(schema_json) if schema_json else {}
+                for name, schema_json in duck_conn.execute("SELECT table_name, schema_json FROM table_metadata").fetchall()
+            }
+        except Exception:
+            metadata = {}
+        niveis = agrupar_tabelas_por_nivel(tables, metadata)
+        schemas = carregar_schemas(duck_conn)
         
-        # 3. Loop de Carga
-        for table in tables:
+        # 3. Loop de Carga: tabelas do mesmo nível não dependem entre si
+        if MAX_WORKERS <= 1 or all(len(nivel) == 1 for nivel in niveis):
+            # Conexão principal só no caminho serial; no paralelo cada thread abre a sua
             try:
-                schema = duck_conn.execute(f"DESCRIBE {table}").fetchall()
-                cols = [c[0] for c in schema]
-                
-                pk_info = duck_conn.execute(f"PRAGMA table_info('{table}')").fetchall()
-                pks = [r[1] for r in pk_info if r[5]]
-                
-                destination.prepare_table(table, schema, pks, [])
-                
-                last_sync = destination.get_last_sync_info(table)
-                ts_col = next((c for c in cols if c in TIMESTAMP_CANDIDATES), None)
-                
-                query = f"SELECT * FROM {table}"
-                params = []
-                
-                if ts_col and last_sync and not TRUNCATE_BEFORE_LOAD:
-                    logger.info(f"[{table}] Modo Incremental. Novos dados desde {last_sync}")
-                    query += f" WHERE {ts_col} > ?"
-                    params.append(last_sync)
-                else:
-                    logger.info(f"[{table}] Modo Full Load")
-                
-                # Executar Carga
-                cursor = duck_conn.execute(query, params)
-                
-                count = destination.load_data(table, cursor, cols, ts_col)
-                logger.info(f"[{table}] Sucesso. {count} linhas sincronizadas.")
-
+                destination = get_strategy(duck_conn)
+                destination.connect()
             except Exception as e:
-                logger.error(f"Erro ao processar tabela {table}: {e}")
+                logger.error(f"Erro fatal na conexão com destino: {e}")
+                return
+            for table in (t for nivel in niveis for t in nivel):
+                if dentro_do_prazo(table):
+                    processar_tabela(table, destination, duck_conn, *schemas[table])
+        else:
+            try:
+                with ThreadPoolExecutor(max_workers=MAX_WORKERS, initializer=abrir_destino_da_thread) as executor:
+                    for nivel in niveis:
+                        # list() espera o nível inteiro antes de liberar o próximo
+                        list(executor.map(processar_na_thread, nivel))
+            except BrokenThreadPool as e:
+                logger.error(f"Erro fatal na conexão com destino: {erros_conexao[0] if erros_conexao else e}")
+
+    except Exception as e:
+        logger.error(f"Erro na execução da carga: {e}")
 
     finally:
-        destination.close()
-        duck_conn.close()
+        for worker_destination, worker_duck in abertos:
+            worker_destination.close()
+            worker_duck.close()
+        if destination is not None:
+            destination.close()
         logger.info(f"Pipeline finalizado em {(datetime.now() - start_time).total_seconds():.2f}s")
 
+def main():
+    configure_logging()
+    # 1. Conexões
+    duck_conn = get_duckdb_conn()
+    try:
+        run(duck_conn)
+    finally:
+        duck_conn.close()
+
 if __name__ == "__main__":
     main()
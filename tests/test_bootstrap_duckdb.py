@@ -0,0 +1,67 @@
+import importlib
+import json
+import sys
+from pathlib import Path
+
+import duckdb
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+bootstrap = importlib.import_module("scripts.bootstrap_duckdb")
+
+
+def _metadata(conn):
+    return {
+        name: json.loads(schema_json)
+        for name, schema_json in conn.execute("SELECT table_name, schema_json FROM table_metadata").fetchall()
+    }
+
+
+def test_ensure_metadata_tables_gera_json_do_catalogo():
+    conn = duckdb.connect()
+    bootstrap.create_tables(conn)
+    bootstrap.ensure_metadata_tables(conn)
+    metadata = _metadata(conn)
+
+    assert set(metadata) == set(bootstrap.SAMPLE_TABLES)
+    # Colunas na ordem da DDL, com PK e FK vindas das constraints
+    assert list(metadata["pedidos"]) == ["id", "cliente_id", "valor_total", "status", "updated_at"]
+    assert metadata["pedidos"]["id"] == {"data_type": "INTEGER", "primary_key": True, "foreign_key": None}
+    assert metadata["pedidos"]["cliente_id"]["foreign_key"] == {"table": "clientes", "column": "id"}
+    assert metadata["pedidos"]["valor_total"]["data_type"] == "DECIMAL(10,2)"
+
+    fks = conn.execute("SELECT * FROM fk_metadata ORDER BY table_name").fetchall()
+    assert fks == [
+        ("itens_pedido", "pedido_id", "pedidos", "id"),
+        ("pagamentos", "pedido_id", "pedidos", "id"),
+        ("pedidos", "cliente_id", "clientes", "id"),
+    ]
+    conn.close()
+
+
+def test_ensure_metadata_tables_e_idempotente():
+    conn = duckdb.connect()
+    bootstrap.create_tables(conn)
+    bootstrap.ensure_metadata_tables(conn)
+    primeira = _metadata(conn)
+    conn.execute("ALTER TABLE clientes ADD COLUMN telefone VARCHAR")
+    bootstrap.ensure_metadata_tables(conn)
+
+    assert conn.execute("SELECT count(*) FROM fk_metadata").fetchone() == (3,)
+    assert _metadata(conn)["clientes"] == {
+        **primeira["clientes"],
+        "telefone": {"data_type": "VARCHAR", "primary_key": False, "foreign_key": None},
+    }
+    conn.close()
+
+
+def test_main_pode_rodar_duas_vezes(tmp_path, monkeypatch):
+    monkeypatch.setattr(bootstrap, "DESTINATION_PATH", str(tmp_path))
+    monkeypatch.setattr(bootstrap, "DUCKDB_PATH", "bootstrap.duckdb")
+    bootstrap.main()
+    bootstrap.main()
+
+    conn = duckdb.connect(str(tmp_path / "bootstrap.duckdb"), read_only=True)
+    for table, rows in bootstrap.SAMPLE_DATA.items():
+        assert conn.execute(f"SELECT count(*) FROM {table}").fetchone() == (len(rows),)
+    conn.close()
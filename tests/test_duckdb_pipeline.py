@@ -0,0 +1,190 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+import duckdb_pipeline  # noqa: E402
+from duckdb_pipeline import DuckDBPipeline  # noqa: E402
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    return DuckDBPipeline(str(tmp_path / "test.duckdb"))
+
+
+def test_conexao_falha_nao_trava_leituras(tmp_path, monkeypatch):
+    monkeypatch.setattr(duckdb_pipeline, "POOL_TIMEOUT", 0.1)
+    falha = DuckDBPipeline(str(tmp_path / "inexistente" / "test.duckdb"))
+    assert falha.conn is None
+    with pytest.raises(RuntimeError):
+        with falha._borrow():
+            pass
+    assert falha.list_tables() == []
+    assert falha.get_table_metadata("qualquer") == {}
+
+
+def test_borrow_expira_com_pool_esgotado(pipeline, monkeypatch):
+    monkeypatch.setattr(duckdb_pipeline, "POOL_TIMEOUT", 0.1)
+    emprestados = [pipeline._pool.get() for _ in range(duckdb_pipeline.POOL_SIZE)]
+    with pytest.raises(RuntimeError):
+        with pipeline._borrow():
+            pass
+    for cursor in emprestados:
+        pipeline._pool.put(cursor)
+    with pipeline._borrow() as cursor:
+        assert cursor.execute("SELECT 1").fetchone() == (1,)
+
+
+@pytest.fixture
+def pedidos(pipeline):
+    pipeline.conn.execute("CREATE TABLE clientes (id INTEGER PRIMARY KEY, nome VARCHAR)")
+    pipeline.conn.execute(
+        "CREATE TABLE pedidos (id INTEGER PRIMARY KEY, cliente_id INTEGER REFERENCES clientes(id), valor DOUBLE)"
+    )
+    pipeline.conn.execute("INSERT INTO clientes VALUES (1, 'Ana'), (2, 'Bia')")
+    pipeline.register_table_metadata("clientes")
+    pipeline.register_table_metadata("pedidos")
+    return pipeline
+
+
+def test_bulk_insert_aceita_tipos_mistos(pedidos):
+    rows = [
+        {"id": 1, "cliente_id": "1", "valor": "10.5"},
+        {"id": "2", "cliente_id": 2, "valor": 7},
+        {"id": 3, "cliente_id": "", "valor": None},
+    ]
+    assert pedidos.bulk_insert("pedidos", rows)
+    assert pedidos.conn.execute("SELECT * FROM pedidos ORDER BY id").fetchall() == [
+        (1, 1, 10.5), (2, 2, 7.0), (3, None, None)
+    ]
+    # PK repetida é descartada pelo ON CONFLICT, sem derrubar o lote
+    assert pedidos.bulk_insert("pedidos", [{"id": 1, "cliente_id": 2, "valor": 1}])
+    assert pedidos.conn.execute("SELECT count(*) FROM pedidos").fetchone() == (3,)
+
+
+def test_bulk_insert_rejeita_fk_inexistente(pedidos):
+    rows = [{"id": 1, "cliente_id": 1, "valor": 1}, {"id": 2, "cliente_id": 99, "valor": 1}]
+    assert not pedidos.bulk_insert("pedidos", rows)
+    assert pedidos.conn.execute("SELECT count(*) FROM pedidos").fetchone() == (0,)
+
+
+def test_insert_data_rejeita_fk_inexistente(pedidos):
+    # Valores do formulário chegam como texto; o DuckDB converte na comparação com a coluna INTEGER
+    assert not pedidos.insert_data("pedidos", {"id": "1", "cliente_id": "99", "valor": "1"})
+    assert pedidos.insert_data("pedidos", {"id": "1", "cliente_id": "2", "valor": "1"})
+    assert pedidos.conn.execute("SELECT id, cliente_id FROM pedidos").fetchall() == [(1, 2)]
+
+
+def test_insert_data_pk_duplicada(pedidos):
+    assert pedidos.insert_data("clientes", {"id": "3", "nome": "Caio"})
+    # ON CONFLICT DO NOTHING RETURNING 1 não devolve linha: o registro existente é preservado
+    assert not pedidos.insert_data("clientes", {"id": "3", "nome": "Outro"})
+    assert pedidos.conn.execute("SELECT nome FROM clientes WHERE id = 3").fetchall() == [("Caio",)]
+
+
+def test_q_valida_e_cita_identificadores(pipeline):
+    assert pipeline._q("clientes") == '"clientes"'
+    assert pipeline._q("_tabela_2") == '"_tabela_2"'
+    assert pipeline._q("região") == '"região"'
+    assert pipeline._q("preço_unit") == '"preço_unit"'
+    for invalido in ['x"; DROP TABLE y; --', "2tabela", "com espaco", "", "nome\n", None]:
+        with pytest.raises(ValueError):
+            pipeline._q(invalido)
+    # Identificadores inválidos nunca entram no cache
+    assert set(pipeline._ident_cache) == {"clientes", "_tabela_2", "região", "preço_unit"}
+
+
+def test_get_all_table_stats_uma_consulta_e_cache(pedidos):
+    pedidos.conn.execute("INSERT INTO pedidos VALUES (1, 1, 9.9)")
+    assert pedidos.get_all_table_stats(["clientes", "pedidos"]) == {"clientes": 2, "pedidos": 1}
+    assert set(pedidos._stats_cache) >= {"clientes", "pedidos"}
+    assert pedidos.get_all_table_stats([]) == {}
+
+
+def test_get_all_table_stats_nome_invalido_cai_para_contagem_individual(pedidos):
+    stats = pedidos.get_all_table_stats(["clientes", "nao existe"])
+    assert stats["clientes"] == 2
+    assert stats["nao existe"] == 0
+
+
+def test_get_column_counts_pelo_schema_json(pedidos):
+    assert pedidos.get_column_counts() == {"clientes": 2, "pedidos": 3}
+
+
+def test_pk_so_nos_metadados_sem_constraint(pipeline):
+    # Tabelas antigas: create_table_dynamic só gerava PRIMARY KEY para chaves compostas
+    pipeline.conn.execute("CREATE TABLE legado (id INTEGER, nome VARCHAR)")
+    pipeline.register_table_metadata("legado")
+    pipeline.conn.execute(
+        "UPDATE table_metadata SET schema_json = ? WHERE table_name = 'legado'",
+        ['{"id": {"data_type": "INTEGER", "primary_key": true, "foreign_key": null},'
+         ' "nome": {"data_type": "VARCHAR", "primary_key": false, "foreign_key": null}}'],
+    )
+    pipeline.invalidate_metadata_cache()
+    assert not pipeline._has_unique_constraint("legado")
+
+    assert pipeline.insert_data("legado", {"id": "1", "nome": "Ana"})
+    assert not pipeline.insert_data("legado", {"id": "1", "nome": "Outra"})
+    assert pipeline.bulk_insert("legado", [{"id": 1, "nome": "Dup"}, {"id": 2, "nome": "Bia"}])
+    assert pipeline.conn.execute("SELECT * FROM legado ORDER BY id").fetchall() == [(1, "Ana"), (2, "Bia")]
+
+
+def test_tabela_com_nome_acentuado(pipeline):
+    pipeline.conn.execute('CREATE TABLE "região" (id INTEGER PRIMARY KEY, "preço_unit" DOUBLE)')
+    pipeline.register_table_metadata("região")
+    assert pipeline.insert_data("região", {"id": "1", "preço_unit": "2.5"})
+    assert pipeline.get_table_data("região").to_pylist() == [{"id": 1, "preço_unit": 2.5}]
+
+
+def test_leituras_externas_usam_o_pool(pedidos):
+    assert pedidos.list_physical_tables() == ["clientes", "fk_metadata", "pedidos", "table_metadata"]
+    livres = pedidos._pool.qsize()
+    with pedidos.read_cursor() as cursor:
+        assert pedidos._pool.qsize() == livres - 1
+        assert cursor.execute("SELECT count(*) FROM clientes").fetchone() == (2,)
+    assert pedidos._pool.qsize() == livres
+
+
+def test_bulk_insert_aceita_tabela_arrow(pedidos):
+    import io
+
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    # Mesmo caminho da aba de importação: CSV lido como texto, vazio vira NULL
+    csv = io.BytesIO(b"id,cliente_id,valor\n1,1,10.5\n2,,\n")
+    table = pacsv.read_csv(
+        csv,
+        convert_options=pacsv.ConvertOptions(
+            column_types={c: pa.string() for c in ["id", "cliente_id", "valor"]},
+            strings_can_be_null=True,
+        ),
+    )
+    assert pedidos.bulk_insert("pedidos", table)
+    assert pedidos.conn.execute("SELECT * FROM pedidos ORDER BY id").fetchall() == [(1, 1, 10.5), (2, None, None)]
+    assert pedidos.bulk_insert("pedidos", table.slice(0, 0))
+    assert not pedidos.bulk_insert("pedidos", pa.table({"nao_existe": [1]}))
+
+
+def test_export_table_csv_tabela_completa(pedidos):
+    # Independe da paginação: todas as linhas, com cabeçalho
+    csv = pedidos.export_table_csv("clientes")
+    assert csv.decode().splitlines() == ["id,nome", "1,Ana", "2,Bia"]
+
+
+def test_create_table_dynamic_falha_nao_deixa_sequence(pipeline):
+    campos = [
+        {"name": "id", "data_type": "INTEGER", "primary_key": True},
+        {"name": "nome", "data_type": "TIPO_INEXISTENTE"},
+    ]
+    with pytest.raises(Exception):
+        pipeline.create_table_dynamic("produtos", campos)
+    sequences = pipeline.conn.execute("SELECT sequence_name FROM duckdb_sequences()").fetchall()
+    assert ("seq_produtos",) not in sequences
+
+    campos[1]["data_type"] = "VARCHAR"
+    assert pipeline.create_table_dynamic("produtos", campos)
+    assert pipeline.insert_data("produtos", {"id": "", "nome": "Caneta"})
+    assert pipeline.conn.execute("SELECT id, nome FROM produtos").fetchall() == [(1, "Caneta")]
@@ -4,6 +4,8 @@ import os
 import sys
 from pathlib import Path
 
+import pytest
+
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 os.environ.setdefault("DUCKDB_PATH", "database.duckdb")
@@ -56,3 +58,368 @@ def test_ordenar_tabelas_topologicamente_com_ciclo_retorna_lista_original():
     }
     ordenadas = loader.ordenar_tabelas_topologicamente(tabelas, metadata)
     assert set(ordenadas) == set(tabelas)
+
+
+def test_marcadores_databricks_formato():
+    placeholders, names = loader.marcadores_databricks(2, 3)
+    assert placeholders == "(:p0_0, :p0_1, :p0_2), (:p1_0, :p1_1, :p1_2)"
+    assert names == ("p0_0", "p0_1", "p0_2", "p1_0", "p1_1", "p1_2")
+
+
+def test_databricks_respeita_teto_de_parametros():
+    class Cursor:
+        def __init__(self):
+            self.chamadas = []
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, query, params):
+            self.chamadas.append((query, params))
+
+    class Origem:
+        def __init__(self, linhas):
+            self.linhas = linhas
+
+        def fetchmany(self, n):
+            lote, self.linhas = self.linhas[:n], self.linhas[n:]
+            return lote
+
+    colunas = [f"c{i}" for i in range(7)]
+    linhas = [tuple(range(i, i + 7)) for i in range(1000)]
+    cursor = Cursor()
+    strategy = loader.DatabricksStrategy.__new__(loader.DatabricksStrategy)
+    strategy.conn = type("Conn", (), {"cursor": lambda self: cursor})()
+
+    total = strategy.load_data("t", Origem(linhas), colunas, None)
+
+    assert total == 1000
+    assert all(len(params) <= loader.DATABRICKS_MAX_PARAMS for _, params in cursor.chamadas)
+    primeiro_query, primeiro_params = cursor.chamadas[0]
+    assert primeiro_query.count("(") - 1 == len(primeiro_params) // 7
+    assert primeiro_params["p0_0"] == 0 and primeiro_params["p1_6"] == 7
+
+
+def _fk(tabela):
+    return {"foreign_key": {"table": tabela, "column": "id"}}
+
+
+def test_agrupar_tabelas_por_nivel_pais_antes_dos_filhos():
+    tabelas = ["itens_pedido", "pedidos", "produtos", "clientes"]
+    metadata = {
+        "clientes": {},
+        "produtos": {},
+        "pedidos": {"cliente_id": _fk("clientes")},
+        "itens_pedido": {"pedido_id": _fk("pedidos"), "produto_id": _fk("produtos")},
+    }
+    niveis = loader.agrupar_tabelas_por_nivel(tabelas, metadata)
+    # Dentro de um nível vale a ordem original das tabelas
+    assert niveis == [["produtos", "clientes"], ["pedidos"], ["itens_pedido"]]
+
+
+def test_agrupar_tabelas_por_nivel_ignora_autorreferencia_e_fk_externa():
+    metadata = {
+        "funcionarios": json.dumps({"gerente_id": _fk("funcionarios"), "setor_id": _fk("fora_do_lote")}),
+    }
+    assert loader.agrupar_tabelas_por_nivel(["funcionarios"], metadata) == [["funcionarios"]]
+
+
+def test_agrupar_tabelas_por_nivel_com_ciclo_uma_tabela_por_nivel():
+    metadata = {"a": {"b_id": _fk("b")}, "b": {"a_id": _fk("a")}, "c": {}}
+    assert loader.agrupar_tabelas_por_nivel(["b", "c", "a"], metadata) == [["b"], ["c"], ["a"]]
+
+
+def _duck_com_tabelas_independentes():
+    import duckdb
+
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE a (id INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE b (id INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE table_metadata (table_name VARCHAR, schema_json JSON)")
+    conn.execute("INSERT INTO table_metadata VALUES ('a', '{}'), ('b', '{}')")
+    return conn
+
+
+def test_run_paralelo_expoe_erro_do_inicializador(monkeypatch, caplog):
+    class DestinoIndisponivel(loader.DestinationStrategy):
+        def connect(self):
+            raise ConnectionError("senha inválida")
+
+        def close(self):
+            pass
+
+        def get_last_sync_info(self, table_name):
+            return None
+
+        def prepare_table(self, table_name, schema, pk_columns, fk_info):
+            pass
+
+        def load_data(self, table_name, data_iterator, columns, ts_column):
+            return 0
+
+    monkeypatch.setattr(loader, "MAX_WORKERS", 2)
+    duck = _duck_com_tabelas_independentes()
+    origens = []
+    monkeypatch.setattr(loader, "get_strategy", lambda conn: origens.append(conn) or DestinoIndisponivel())
+    with caplog.at_level("ERROR"):
+        loader.run(duck)
+    duck.close()
+
+    mensagens = [r.getMessage() for r in caplog.records]
+    assert any("Erro fatal na conexão com destino: senha inválida" in m for m in mensagens)
+    assert not any("Erro na execução da carga" in m for m in mensagens)
+    # No caminho paralelo só as threads abrem destino, cada uma com seu cursor
+    assert origens and duck not in origens
+
+
+def test_run_nao_inicia_tabelas_apos_o_prazo(monkeypatch, caplog):
+    class Destino:
+        def connect(self):
+            pass
+
+        def close(self):
+            pass
+
+    processadas = []
+    monkeypatch.setattr(loader, "MAX_WORKERS", 1)
+    monkeypatch.setattr(loader, "get_strategy", lambda conn: Destino())
+    monkeypatch.setattr(loader, "processar_tabela", lambda table, *args: processadas.append(table))
+    duck = _duck_com_tabelas_independentes()
+    with caplog.at_level("ERROR"):
+        loader.run(duck, timeout=1e-9)
+    loader.run(duck)
+    duck.close()
+
+    assert sum("Tempo limite" in r.getMessage() for r in caplog.records) == 2
+    assert sorted(processadas) == ["a", "b"]
+
+
+def test_buscar_em_segundo_plano_preserva_ordem_e_esgota():
+    gerador = loader.buscar_em_segundo_plano(iter(range(50)), profundidade=2)
+    assert list(gerador) == list(range(50))
+    assert next(gerador, None) is None
+    assert list(loader.buscar_em_segundo_plano(iter([]))) == []
+
+
+def test_buscar_em_segundo_plano_propaga_erro_do_produtor():
+    def lotes():
+        yield 1
+        yield 2
+        raise IOError("falha na leitura")
+
+    recebidos = []
+    with pytest.raises(IOError, match="falha na leitura"):
+        for item in loader.buscar_em_segundo_plano(lotes()):
+            recebidos.append(item)
+    assert recebidos == [1, 2]
+
+
+def test_buscar_em_segundo_plano_libera_produtor_quando_consumidor_para():
+    import itertools
+    import threading
+
+    antes = threading.active_count()
+    gerador = loader.buscar_em_segundo_plano(itertools.count(), profundidade=1)
+    assert next(gerador) == 0
+    gerador.close()
+    assert threading.active_count() == antes
+
+
+class _DestinoFalso(loader.DestinationStrategy):
+    def __init__(self, last_sync=None):
+        self.last_sync = last_sync
+        self.chamadas = []
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_last_sync_info(self, table_name):
+        return self.last_sync
+
+    def prepare_table(self, table_name, schema, pk_columns, fk_info):
+        self.chamadas.append("prepare_table")
+
+    def load_data(self, table_name, data_iterator, columns, ts_column):
+        self.chamadas.append("load_data")
+        return len(data_iterator.fetchall())
+
+    def rollback(self):
+        self.chamadas.append("rollback")
+
+
+def _duck_com_updated_at():
+    import duckdb
+
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE t (id INTEGER, updated_at TIMESTAMP)")
+    conn.execute("INSERT INTO t VALUES (1, TIMESTAMP '2024-01-01 10:00:00')")
+    return conn
+
+
+def test_processar_tabela_sem_alteracoes_encerra_transacao(monkeypatch):
+    from datetime import datetime
+
+    monkeypatch.setattr(loader, "TRUNCATE_BEFORE_LOAD", False)
+    duck = _duck_com_updated_at()
+    destino = _DestinoFalso(last_sync=datetime(2024, 1, 2))
+    loader.processar_tabela("t", destino, duck, [("id", "INTEGER"), ("updated_at", "TIMESTAMP")], [])
+    assert destino.chamadas == ["rollback"]
+
+    destino = _DestinoFalso(last_sync=datetime(2023, 12, 31))
+    loader.processar_tabela("t", destino, duck, [("id", "INTEGER"), ("updated_at", "TIMESTAMP")], [])
+    assert destino.chamadas == ["prepare_table", "load_data"]
+    duck.close()
+
+
+def test_supabase_tabela_ausente_no_destino_volta_por_carga_completa():
+    supabase = loader.SupabaseStrategy.__new__(loader.SupabaseStrategy)
+    supabase.existing_tables = set()
+    # Sem consulta ao controle_cargas: conn nem é usada
+    supabase.conn = None
+    assert supabase.get_last_sync_info("clientes") is None
+
+
+def test_processar_tabela_desfaz_preparo_quando_leitura_falha():
+    duck = _duck_com_updated_at()
+    destino = _DestinoFalso()
+    # Tabela ausente no DuckDB: a consulta falha entre prepare_table e load_data
+    loader.processar_tabela("ausente", destino, duck, [("id", "INTEGER")], [])
+    duck.close()
+    assert destino.chamadas == ["prepare_table", "rollback"]
+
+
+def test_supabase_tabela_truncada_sem_pk_usa_copy_direto(monkeypatch):
+    monkeypatch.setattr(loader, "TRUNCATE_BEFORE_LOAD", True)
+    supabase = loader.SupabaseStrategy.__new__(loader.SupabaseStrategy)
+    supabase.conflict_free_tables = set()
+    monkeypatch.setattr(supabase, "_prepare_table", lambda *args: None, raising=False)
+    supabase.prepare_table("logs", [("msg", "VARCHAR")], [], [])
+    supabase.prepare_table("clientes", [("id", "INTEGER")], ["id"], [])
+    assert supabase.conflict_free_tables == {"logs", "clientes"}
+
+
+class _CursorPostgres:
+    """Cursor psycopg2 de mentira: guarda o SQL executado e o conteúdo de cada COPY."""
+
+    def __init__(self):
+        self.executados = []
+        self.copias = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        texto = query if isinstance(query, str) else query.as_string(self)
+        self.executados.append((texto, params))
+
+    def copy_expert(self, query, buffer):
+        self.copias.append((query, buffer.read().decode()))
+
+
+class _ConexaoPostgres:
+    def __init__(self):
+        self.cur = _CursorPostgres()
+        self.commits = 0
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    # Identificadores citados sem conexão real com o Postgres
+    monkeypatch.setattr(loader.sql.ext, "quote_ident", lambda nome, contexto: f'"{nome}"')
+    strategy = loader.SupabaseStrategy.__new__(loader.SupabaseStrategy)
+    strategy.conn = _ConexaoPostgres()
+    strategy.conflict_free_tables = set()
+    return strategy
+
+
+def _duck_pedidos():
+    import duckdb
+
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE pedidos (id INTEGER, updated_at TIMESTAMP, tags VARCHAR[])")
+    conn.execute(
+        """
+        INSERT INTO pedidos VALUES
+            (1, TIMESTAMP '2024-01-03 08:00:00', ['a']),
+            (2, NULL, NULL),
+            (3, TIMESTAMP '2024-01-05 09:30:00', ['b', 'c'])
+        """
+    )
+    return conn
+
+
+def test_supabase_escolhe_insert_para_tipos_sem_copy(supabase, monkeypatch):
+    escolhas = []
+    monkeypatch.setattr(supabase, "_load_copy", lambda *args: escolhas.append("copy") or 0, raising=False)
+    monkeypatch.setattr(supabase, "_load_values", lambda *args: escolhas.append("values") or 0, raising=False)
+    duck = _duck_pedidos()
+    supabase.load_data("pedidos", duck.execute("SELECT id, updated_at FROM pedidos"), ["id", "updated_at"], None)
+    supabase.load_data("pedidos", duck.execute("SELECT * FROM pedidos"), ["id", "updated_at", "tags"], None)
+    duck.close()
+    assert escolhas == ["copy", "values"]
+
+
+def test_csv_batches_calcula_maior_timestamp_ignorando_nulos():
+    from datetime import datetime
+
+    duck = _duck_pedidos()
+    lotes = list(loader.SupabaseStrategy._csv_batches(duck.execute("SELECT id, updated_at FROM pedidos"), "updated_at"))
+    duck.close()
+    assert [(n, maximo) for _, n, maximo in lotes] == [(3, datetime(2024, 1, 5, 9, 30))]
+    assert lotes[0][0].getvalue().decode().splitlines()[1] == "2,"
+
+
+def test_load_copy_com_staging_e_direto(supabase):
+    from datetime import datetime
+
+    duck = _duck_pedidos()
+    consulta = "SELECT id, updated_at FROM pedidos"
+    total = supabase.load_data("pedidos", duck.execute(consulta), ["id", "updated_at"], "updated_at")
+    cur = supabase.conn.cur
+    assert total == 3
+    assert cur.copias[0][0] == 'COPY "_stg_pedidos" ("id", "updated_at") FROM STDIN WITH (FORMAT CSV)'
+    assert cur.executados[0][0].startswith('CREATE TEMP TABLE "_stg_pedidos"')
+    assert "ON CONFLICT DO NOTHING" in cur.executados[1][0]
+    # Marca d'água do controle: maior timestamp carregado, pelo mesmo cursor da carga
+    assert cur.executados[2][1] == (datetime(2024, 1, 5, 9, 30), 3, "pedidos")
+    assert supabase.conn.commits == 1
+
+    supabase.conn = _ConexaoPostgres()
+    supabase.conflict_free_tables.add("pedidos")
+    supabase.load_data("pedidos", duck.execute(consulta), ["id", "updated_at"], "updated_at")
+    duck.close()
+    cur = supabase.conn.cur
+    assert cur.copias[0][0] == 'COPY "pedidos" ("id", "updated_at") FROM STDIN WITH (FORMAT CSV)'
+    assert [q for q, _ in cur.executados if "_stg_" in q or "ON CONFLICT" in q] == []
+
+
+def test_carregar_schemas_colunas_em_ordem_e_pks():
+    import duckdb
+
+    duck = duckdb.connect()
+    duck.execute("CREATE TABLE itens (pedido_id INTEGER, produto_id INTEGER, qtd INTEGER, PRIMARY KEY (pedido_id, produto_id))")
+    duck.execute("CREATE TABLE logs (msg VARCHAR, criado_em TIMESTAMP)")
+    schemas = loader.carregar_schemas(duck)
+    duck.close()
+    assert schemas == {
+        "itens": ([("pedido_id", "INTEGER"), ("produto_id", "INTEGER"), ("qtd", "INTEGER")], ["pedido_id", "produto_id"]),
+        "logs": ([("msg", "VARCHAR"), ("criado_em", "TIMESTAMP")], []),
+    }